@@ -7,17 +7,45 @@
 
 import os
 import re
+import csv
+import hashlib
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import count, islice
 
 # .envファイルから環境変数を読み込み（ローカル開発用）
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, current_app, render_template, request, redirect, url_for, flash, jsonify, session, Response
+from flask.json.provider import DefaultJSONProvider
 from functools import wraps
+import numpy as np
+import orjson
 import pandas as pd
 from werkzeug.utils import secure_filename
 
+# R2ストレージ連携（storageはboto3を使うときに読み込むので、R2を使わない環境でもimportできる）
+# 文字コード判定と欠損値の正規化はR2から読むデータと共通
+from storage import (
+    ENCODING_SNIFF_BYTES, detect_content_encoding, none_to_nan,
+    download_product_master, upload_product_master, get_product_master_info,
+    is_r2_enabled, save_ga4_data, get_latest_ga4_data,
+    save_passwords as r2_save_passwords, load_passwords as r2_load_passwords,
+    save_period_data, load_period_data, get_available_periods,
+    save_channel_data, load_channel_data, save_campaign_data, load_campaign_data
+)
+
+# PyArrowがあればCSVをマルチスレッドのパーサで読む
+try:
+    import pyarrow
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
 # ============================================
 # パスワード管理システム
 # ============================================
@@ -26,6 +54,22 @@ password_cache = {
     'admin': None,
     'brands': {}
 }
+# パスワードのSHA-256ハッシュ → ('admin', None) / ('brand', brand) の逆引き表
+password_index = {}
+# password_cache/password_indexの書き換え（R2からの反映と管理画面からの更新）を直列化
+password_lock = threading.Lock()
+# update_passwordのたびに増やす（R2の取得中に更新されたら古い値で上書きしない）
+password_generation = 0
+
+# セッション認可情報のキャッシュ {sid: (作成時刻, {'is_admin': bool, 'accessible_set': frozenset})}
+# 中身は署名付きセッションの値から作るだけなので、パスワード変更時に破棄しても権限は変わらない
+auth_cache = {}
+AUTH_CACHE_TTL = 3600  # 1時間
+AUTH_CACHE_SIZE = 1024  # ログアウトせずに切れたセッションの分も含めた上限
+auth_cache_lock = threading.Lock()
+
+# パスワードのローカルキャッシュ（ワーカー起動時にR2の応答を待たない）
+PASSWORD_CACHE_PATH = os.environ.get('PASSWORD_CACHE_PATH', '/tmp/password_cache.json')
 
 def get_default_passwords():
     """環境変数から初期パスワードを取得"""
@@ -39,57 +83,158 @@ def get_default_passwords():
         }
     }
 
-def init_passwords():
-    """パスワードを初期化（R2から読み込み、なければ環境変数から）"""
+def hash_password(password):
+    """パスワードのSHA-256ダイジェストを返す"""
+    return hashlib.sha256(password.encode('utf-8')).digest()
+
+
+def rebuild_password_index():
+    """password_cacheからハッシュの逆引き表を作り直す（管理者が優先）"""
+    global password_index
+    
+    index = {}
+    if password_cache.get('admin'):
+        index[hash_password(password_cache['admin'])] = ('admin', None)
+    for brand, pwd in password_cache.get('brands', {}).items():
+        if pwd:
+            index.setdefault(hash_password(pwd), ('brand', brand))
+    password_index = index
+
+
+def save_local_passwords(passwords):
+    """パスワードをローカルキャッシュファイルに保存（所有者のみ読み書き可）"""
+    try:
+        fd = os.open(PASSWORD_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(orjson.dumps(passwords))
+    except Exception as e:
+        print(f"[WARN] Failed to write password cache: {e}")
+
+
+def load_local_passwords():
+    """ローカルキャッシュファイルからパスワードを読み込み"""
+    try:
+        with open(PASSWORD_CACHE_PATH, 'rb') as f:
+            return orjson.loads(f.read())
+    except Exception:
+        return None
+
+
+def refresh_passwords_from_r2():
+    """R2からパスワードを読み込み、メモリとローカルキャッシュを更新"""
     global password_cache
     
-    # R2から読み込みを試行
-    if r2_load_passwords:
-        r2_passwords = r2_load_passwords()
-        if r2_passwords:
-            password_cache = r2_passwords
-            print("[OK] Loaded passwords from R2")
+    generation = password_generation
+    r2_passwords = r2_load_passwords()
+    if not r2_passwords:
+        return
+    
+    with password_lock:
+        if generation != password_generation:
+            print("[INFO] Passwords were updated while loading from R2, keeping current values")
             return
+        password_cache = r2_passwords
+        rebuild_password_index()
+        save_local_passwords(r2_passwords)
+    print("[OK] Loaded passwords from R2")
+
+
+def init_passwords():
+    """パスワードを初期化（R2利用時はローカルキャッシュ→R2をバックグラウンドで反映、それ以外は環境変数）"""
+    global password_cache
+    
+    use_r2 = is_r2_enabled()
     
-    # 環境変数から初期値を設定
-    password_cache = get_default_passwords()
-    print("[OK] Initialized passwords from environment variables")
+    with password_lock:
+        # ローカルキャッシュはR2の写しなので、R2を使うときだけ読む
+        local_passwords = load_local_passwords() if use_r2 else None
+        if local_passwords:
+            password_cache = local_passwords
+            print("[OK] Loaded passwords from local cache")
+        else:
+            # 環境変数から初期値を設定
+            password_cache = get_default_passwords()
+            print("[OK] Initialized passwords from environment variables")
+        rebuild_password_index()
+    
+    # R2の最新値は起動をブロックせずに取得
+    if use_r2:
+        threading.Thread(target=refresh_passwords_from_r2, daemon=True).start()
 
 def check_password(entered_password):
     """
     パスワードをチェックし、アクセス可能なブランドを返す
     Returns: {'is_admin': bool, 'brands': list} or None
     """
-    global password_cache
-    
-    # 管理者パスワードチェック
-    if entered_password == password_cache.get('admin'):
-        return {'is_admin': True, 'brands': BRANDS}
+    if not entered_password:
+        return None
     
-    # ブランドパスワードチェック
-    for brand, pwd in password_cache.get('brands', {}).items():
-        if entered_password == pwd:
-            return {'is_admin': False, 'brands': [brand]}
+    # ハッシュ1回＋辞書引きで判定（平文の線形比較はしない）
+    entry = password_index.get(hash_password(entered_password))
+    if entry is None:
+        return None
     
-    return None
+    kind, brand = entry
+    if kind == 'admin':
+        return {'is_admin': True, 'brands': BRANDS}
+    return {'is_admin': False, 'brands': [brand]}
 
 def update_password(password_type, brand_key=None, new_password=None):
     """パスワードを更新（R2にも保存）"""
-    global password_cache
-    
-    if password_type == 'admin':
-        password_cache['admin'] = new_password
-    elif password_type == 'brand' and brand_key:
-        if 'brands' not in password_cache:
-            password_cache['brands'] = {}
-        password_cache['brands'][brand_key.lower()] = new_password
-    
-    # R2に保存
-    if r2_save_passwords:
-        r2_save_passwords(password_cache)
+    global password_cache, password_generation
+    
+    with password_lock:
+        if password_type == 'admin':
+            password_cache['admin'] = new_password
+        elif password_type == 'brand' and brand_key:
+            if 'brands' not in password_cache:
+                password_cache['brands'] = {}
+            password_cache['brands'][brand_key.lower()] = new_password
+        password_generation += 1
+        rebuild_password_index()
+        
+        # R2とローカルキャッシュに保存（ローカルキャッシュはR2の写しなのでR2利用時のみ）
+        if is_r2_enabled():
+            r2_save_passwords(password_cache)
+            save_local_passwords(password_cache)
     
     return True
 
+def get_session_auth():
+    """現在のセッションの認可情報を取得（sid単位でTTL付きキャッシュ）"""
+    sid = session.get('sid')
+    now = time.time()
+    entry = auth_cache.get(sid) if sid else None
+    if entry:
+        if now - entry[0] < AUTH_CACHE_TTL:
+            return entry[1]
+        # 期限切れは見つけた時点で捨てる
+        auth_cache.pop(sid, None)
+    
+    # キャッシュがなければセッションから組み立てる
+    auth = {
+        'is_admin': bool(session.get('is_admin')),
+        'accessible_set': frozenset(b.lower() for b in session.get('accessible_brands', [])),
+    }
+    if sid:
+        with auth_cache_lock:
+            if len(auth_cache) >= AUTH_CACHE_SIZE:
+                prune_auth_cache()
+                # 期限内のものだけで上限に達していたら古いものから捨てる
+                while len(auth_cache) >= AUTH_CACHE_SIZE:
+                    auth_cache.pop(next(iter(auth_cache)))
+            auth_cache[sid] = (now, auth)
+    return auth
+
+
+def prune_auth_cache():
+    """期限切れの認可キャッシュを削除"""
+    now = time.time()
+    for sid, (created, _) in list(auth_cache.items()):
+        if now - created >= AUTH_CACHE_TTL:
+            auth_cache.pop(sid, None)
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -104,7 +249,7 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if not session.get('logged_in'):
             return redirect(url_for('login'))
-        if not session.get('is_admin'):
+        if not get_session_auth()['is_admin']:
             flash('この機能は管理者のみ利用可能です', 'error')
             return redirect(url_for('index'))
         return f(*args, **kwargs)
@@ -112,38 +257,9 @@ def admin_required(f):
 
 def can_access_brand(brand_name):
     """現在のセッションで指定ブランドにアクセス可能か"""
-    if session.get('is_admin'):
-        return True
-    accessible = session.get('accessible_brands', [])
+    auth = get_session_auth()
     # ブランド名の正規化（大文字小文字無視）
-    brand_lower = brand_name.lower()
-    return any(b.lower() == brand_lower for b in accessible)
-
-# R2ストレージ連携
-try:
-    from storage import (
-        download_product_master, upload_product_master, get_product_master_info, 
-        is_r2_enabled, save_ga4_data, get_latest_ga4_data,
-        save_passwords as r2_save_passwords, load_passwords as r2_load_passwords,
-        save_period_data, load_period_data, get_available_periods,
-        save_channel_data, load_channel_data, save_campaign_data, load_campaign_data
-    )
-except ImportError:
-    is_r2_enabled = lambda: False
-    download_product_master = None
-    save_ga4_data = None
-    get_latest_ga4_data = None
-    upload_product_master = None
-    get_product_master_info = None
-    r2_save_passwords = None
-    save_period_data = None
-    load_period_data = None
-    get_available_periods = None
-    r2_load_passwords = None
-    save_channel_data = None
-    load_channel_data = None
-    save_campaign_data = None
-    load_campaign_data = None
+    return auth['is_admin'] or brand_name.lower() in auth['accessible_set']
 
 # GA4 API連携
 try:
@@ -158,7 +274,33 @@ except ImportError:
     fetch_weekly_data = None
     fetch_all_brands_data = None
 
+# JSONレスポンスのorjsonオプション
+# NumPyの値はそのまま変換（NaNはnull）、dict の数値キーも許可、datetimeはFlask標準と同じ形式にするためdefaultに回す
+ORJSON_RESPONSE_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonifyのレスポンスをorjsonで作成（セッションなどのdumps/loadsは標準のjsonのまま）"""
+    
+    def response(self, *args, **kwargs):
+        # jsonifyと同じ引数の扱い（位置引数1つはそのまま、複数ならリスト、キーワード引数ならdict）
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if not args and not kwargs:
+            obj = None
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = args or kwargs
+        
+        # Flask標準と同じくキーをソートして出力
+        option = ORJSON_RESPONSE_OPTIONS | orjson.OPT_SORT_KEYS if self.sort_keys else ORJSON_RESPONSE_OPTIONS
+        return current_app.response_class(
+            orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
@@ -167,6 +309,8 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # グローバルデータストア（本番ではDBを使用）
+# ga_sales / ga_sales_previous / channel_data / campaign_data は periods_data 側と同じdictを共有するため、
+# 更新時はdictを作り直して差し替える（その場で書き換えない）
 data_store = {
     'product_master': None,
     'product_master_info': None,  # R2からの情報
@@ -176,6 +320,10 @@ data_store = {
     'campaign_data': {},  # キャンペーン別データ {'rady': {'current': df, 'previous': df}, ...}
     'merged_data': None,
     'merged_data_previous': None,  # 前期間のマージデータ
+    'precomputed': None,  # merged_dataから作ったソート済みスライス（build_precomputed参照）
+    'product_master_indexed': None,  # sku_idをインデックスにした商品マスタ（get_indexed_product_master参照）
+    'pv_ranking_cache': None,  # merged_dataごとのPVランキング結果とSKU詳細（get_pv_ranking_cache参照）
+    'dashboard': None,  # merged_dataごとのダッシュボード集計（get_dashboard_data参照）
     'current_period': 'yesterday',  # 現在表示中の期間
     # 期間別データ（自動更新用）
     'periods_data': {
@@ -185,56 +333,251 @@ data_store = {
     }
 }
 
+# data_storeの書き込み用ロック（読み込み側は参照を1回取るだけなのでロックしない）
+# 期間切替・再分析の途中状態を別スレッドの書き込みと混ぜないためにRLockで直列化する
+store_lock = threading.RLock()
+
+
+def with_store_lock(f):
+    """data_storeを書き換える関数をstore_lockの中で実行するデコレータ"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        with store_lock:
+            return f(*args, **kwargs)
+    return decorated
+
 # 登録済みブランド一覧
 BRANDS = ['rady', 'cherimi', 'michellmacaron', 'solni']
 
+# merge_and_analyzeの結果キャッシュ（直近1件のみ）
+# inputsで入力DataFrameへの参照を保持し、id()の再利用による誤ヒットを防ぐ
+merge_cache = {
+    'key': None,
+    'inputs': None,
+    'result': None,
+}
+
+# 読み込み済みCSVのキャッシュ（(種類, ファイル内容のハッシュ) → 処理済みの結果）
+# 同じ内容のCSVを再アップロードしたときは解析を省き、同じDataFrameを返す
+CSV_CACHE_SIZE = 16
+csv_cache = {}
+
+# 処理済み商品マスタのローカルスナップショット（Parquet）と、元になったR2ファイルの情報
+# 起動時・同期時にR2のファイルが変わっていなければCSVのダウンロードと解析を省く
+PRODUCT_MASTER_SNAPSHOT_PATH = os.environ.get(
+    'PRODUCT_MASTER_SNAPSHOT_PATH', os.path.join(app.config['UPLOAD_FOLDER'], 'product_master.parquet'))
+PRODUCT_MASTER_SNAPSHOT_META_PATH = PRODUCT_MASTER_SNAPSHOT_PATH + '.json'
+
+
+# 商品マスタでcategory型にするカラム
+CATEGORY_COLS = ['brand', 'publish_status', 'sales_status', 'color_tag', 'color_name', 'size', 'product_class_id']
+
+# CSV読み込み時に型を固定するカラム（文字列カラムの型推論を省く）
+# category化はCATEGORY_COLSで行う（読み込み時に指定するとカテゴリ順が変わるため）
+# 在庫・売上などの数値カラムは表記ゆれをto_numeric(errors='coerce')で吸収するため指定しない
+PRODUCT_MASTER_DTYPES = {
+    'SKU商品ID': object,
+    '商品ID（型単位）': object,
+    'ブランド名': object,
+    '商品名': object,
+    'カラー名': object,
+    'カラータグ': object,
+    'サイズ名': object,
+    '商品ページURL': object,
+    '商品画像URL': object,
+    '公開ステータス': object,
+    '販売ステータス': object,
+}
+GA_CSV_DTYPES = {
+    'Item ID': object,
+    'Item name': object,
+}
+
+
+def read_csv_fast(filepath, **kwargs):
+    """CSVを読み込み（PyArrowで読めなければCエンジンで再試行）"""
+    if CSV_ENGINE == 'pyarrow':
+        try:
+            return none_to_nan(pd.read_csv(filepath, engine='pyarrow', **kwargs))
+        except Exception:
+            pass
+    return pd.read_csv(filepath, **kwargs)
+
+
+# 商品マスタCSVのカラム名 → 内部カラム名（これ以外のカラムは読み込まない）
+PRODUCT_MASTER_COL_MAP = {
+    'SKU商品ID': 'sku_id',
+    '商品ID（型単位）': 'product_class_id',
+    'ブランド名': 'brand',
+    '商品名': 'product_name',
+    'カラー名': 'color_name',
+    'カラータグ': 'color_tag',
+    'サイズ名': 'size',
+    '販売価格': 'price',
+    'WEB在庫': 'web_stock',
+    '調整在庫': 'adjust_stock',
+    '見込み在庫': 'expected_stock',
+    '商品ページURL': 'product_url',
+    '商品画像URL': 'image_url',
+    '公開ステータス': 'publish_status',
+    '販売ステータス': 'sales_status',
+}
+
+# 商品マスタの処理内容（process_product_master_dfの除外・型変換など）を変えたら上げる
+PRODUCT_MASTER_SNAPSHOT_VERSION = 1
+
+# スナップショットを作ったコードの処理内容（カラム・型の定義が変われば古いスナップショットは使わない）
+PRODUCT_MASTER_SNAPSHOT_SCHEMA = {
+    'version': PRODUCT_MASTER_SNAPSHOT_VERSION,
+    'col_map': PRODUCT_MASTER_COL_MAP,
+    'dtypes': {col: str(dtype) for col, dtype in PRODUCT_MASTER_DTYPES.items()},
+    'category_cols': CATEGORY_COLS,
+}
+
 
 def process_product_master_df(df):
     """商品マスタDataFrameを処理"""
     # 必要なカラムを抽出・リネーム
-    col_map = {
-        'SKU商品ID': 'sku_id',
-        '商品ID（型単位）': 'product_class_id',
-        'ブランド名': 'brand',
-        '商品名': 'product_name',
-        'カラー名': 'color_name',
-        'カラータグ': 'color_tag',
-        'サイズ名': 'size',
-        '販売価格': 'price',
-        'WEB在庫': 'web_stock',
-        '調整在庫': 'adjust_stock',
-        '見込み在庫': 'expected_stock',
-        '商品ページURL': 'product_url',
-        '商品画像URL': 'image_url',
-        '公開ステータス': 'publish_status',
-        '販売ステータス': 'sales_status',
-    }
     # 存在するカラムのみリネーム
-    existing_cols = {k: v for k, v in col_map.items() if k in df.columns}
-    df = df.rename(columns=existing_cols)
+    existing_cols = {k: v for k, v in PRODUCT_MASTER_COL_MAP.items() if k in df.columns}
+    df = df[list(existing_cols)].rename(columns=existing_cols)
+    
+    # Regalectは分析対象外なので読み込み時点で除外
+    if 'brand' in df.columns:
+        df = df[df['brand'] != 'Regalect']
     
     # 在庫合計を計算
     stock_cols = ['web_stock', 'adjust_stock', 'expected_stock']
     for col in stock_cols:
         if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(np.int32)
     
-    df['total_stock'] = df[['web_stock', 'adjust_stock', 'expected_stock']].sum(axis=1) if all(c in df.columns for c in stock_cols) else 0
+    # 3カラムとも欠損埋め済みのint32なので、NumPy配列をそのまま足す
+    if all(c in df.columns for c in stock_cols):
+        df['total_stock'] = np.add.reduce([df[c].to_numpy() for c in stock_cols], dtype=np.int32)
+    else:
+        df['total_stock'] = 0
+    
+    # 種類の少ない文字列カラムはcategory型に（フィルタ・groupbyを整数コードで処理）
+    for col in CATEGORY_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
     
     return df
 
 
+def file_digest(filepath):
+    """ファイル内容のハッシュを計算"""
+    digest = hashlib.blake2b()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def detect_encoding(filepath):
+    """ファイル先頭だけを読んで文字コードを判定"""
+    with open(filepath, 'rb') as f:
+        return detect_content_encoding(f.read(ENCODING_SNIFF_BYTES))
+
+
+def candidate_encodings(filepath, encodings):
+    """判定した文字コードを先頭にした試行順を返す（判定が外れたときだけ残りを試す）"""
+    detected = detect_encoding(filepath)
+    return [detected] + [enc for enc in encodings if enc != detected]
+
+
+def load_csv_cached(kind, filepath, loader):
+    """同じ内容のCSVは解析済みの結果を返す（なければloaderで読み込んでキャッシュ）"""
+    key = (kind, file_digest(filepath))
+    result = csv_cache.get(key)
+    if result is None:
+        result = loader(filepath)
+        # 古いものから捨てる
+        if len(csv_cache) >= CSV_CACHE_SIZE:
+            csv_cache.pop(next(iter(csv_cache)))
+        csv_cache[key] = result
+    return result
+
+
 def load_product_master(filepath):
+    """商品マスタCSVを読み込み（内容が同じなら前回の結果を使う）"""
+    return load_csv_cached('product_master', filepath, parse_product_master)
+
+
+def get_snapshot_source(info):
+    """R2の商品マスタ情報と処理内容からスナップショット照合用の情報を作成（ファイルがなければNone）"""
+    if not info or not info.get('exists'):
+        return None
+    return {'key': info['key'], 'size': info['size'], 'last_modified': str(info['last_modified']),
+            'schema': PRODUCT_MASTER_SNAPSHOT_SCHEMA}
+
+
+def save_product_master_snapshot(pm, info):
+    """処理済み商品マスタをParquetで保存（照合用にR2ファイルの情報も保存）"""
+    source = get_snapshot_source(info)
+    if source is None or CSV_ENGINE != 'pyarrow':
+        return False
+    try:
+        pm.to_parquet(PRODUCT_MASTER_SNAPSHOT_PATH, compression='zstd')
+        with open(PRODUCT_MASTER_SNAPSHOT_META_PATH, 'wb') as f:
+            f.write(orjson.dumps(source))
+        return True
+    except Exception as e:
+        print(f"[WARN] Failed to save product master snapshot: {e}")
+        return False
+
+
+def load_product_master_snapshot(info):
+    """R2のファイルがスナップショット保存時と同じなら処理済み商品マスタを読み込む（違えばNone）"""
+    source = get_snapshot_source(info)
+    if source is None or CSV_ENGINE != 'pyarrow' or not os.path.exists(PRODUCT_MASTER_SNAPSHOT_META_PATH):
+        return None
+    try:
+        with open(PRODUCT_MASTER_SNAPSHOT_META_PATH, 'rb') as f:
+            if orjson.loads(f.read()) != source:
+                return None
+        return none_to_nan(pd.read_parquet(PRODUCT_MASTER_SNAPSHOT_PATH))
+    except Exception as e:
+        print(f"[WARN] Failed to load product master snapshot: {e}")
+        return None
+
+
+def load_product_master_from_r2():
+    """R2の商品マスタを読み込み（変わっていなければローカルのスナップショットを使う）、情報と合わせて返す"""
+    info = get_product_master_info()
+    pm = load_product_master_snapshot(info)
+    if pm is not None:
+        print(f"[OK] Loaded product master from local snapshot: {len(pm)} rows")
+        return pm, info
+    
+    df = download_product_master()
+    if df is None or len(df) == 0:
+        return None, info
+    pm = process_product_master_df(df)
+    save_product_master_snapshot(pm, info)
+    return pm, info
+
+
+def parse_product_master(filepath):
     """商品マスタCSVを読み込み（cp932/utf-8対応）"""
-    for enc in ['cp932', 'utf-8', 'utf-8-sig']:
+    for enc in candidate_encodings(filepath, ['cp932', 'utf-8', 'utf-8-sig']):
         try:
-            df = pd.read_csv(filepath, encoding=enc)
+            # 使うカラムだけ読み込む（ヘッダー行だけ先に読んで存在するものを指定する）
+            header = pd.read_csv(filepath, encoding=enc, nrows=0).columns
+            usecols = [col for col in header if col in PRODUCT_MASTER_COL_MAP] or None
+            df = read_csv_fast(filepath, encoding=enc, usecols=usecols, dtype=PRODUCT_MASTER_DTYPES)
             return process_product_master_df(df)
         except Exception:
             continue
     raise ValueError("CSVの読み込みに失敗しました")
 
 
+# GA4 CSVヘッダーの期間・プロパティ行（1行につき1回の検索で項目名と値を取り出す）
+GA_HEADER_RE = re.compile(r'(Start date|End date|Property):\s*(.+)')
+GA_DATE_RE = re.compile(r'\d{8}')
+
+
 def parse_ga_period(lines):
     """GA4 CSVのヘッダーから期間情報を抽出"""
     period = {
@@ -246,33 +589,24 @@ def parse_ga_period(lines):
     }
     
     for line in lines[:15]:  # 最初の15行だけチェック
-        line = line.strip()
-        
-        # Start date: 20251127 形式
-        if 'Start date:' in line:
-            match = re.search(r'Start date:\s*(\d{8})', line)
-            if match:
-                date_str = match.group(1)
-                try:
-                    period['start_date'] = datetime.strptime(date_str, '%Y%m%d')
-                except:
-                    pass
-        
-        # End date: 20251128 形式
-        if 'End date:' in line:
-            match = re.search(r'End date:\s*(\d{8})', line)
-            if match:
-                date_str = match.group(1)
-                try:
-                    period['end_date'] = datetime.strptime(date_str, '%Y%m%d')
-                except:
-                    pass
+        match = GA_HEADER_RE.search(line)
+        if not match:
+            continue
+        key, value = match.group(1), match.group(2).strip()
         
         # Property名
-        if 'Property:' in line:
-            match = re.search(r'Property:\s*(.+)', line)
-            if match:
-                period['property'] = match.group(1).strip()
+        if key == 'Property':
+            period['property'] = value
+            continue
+        
+        # Start date: 20251127 / End date: 20251128 形式
+        date_match = GA_DATE_RE.match(value)
+        if date_match:
+            try:
+                date = datetime.strptime(date_match.group(0), '%Y%m%d')
+            except ValueError:
+                continue
+            period['start_date' if key == 'Start date' else 'end_date'] = date
     
     # 日数計算と期間タイプ判定
     if period['start_date'] and period['end_date']:
@@ -291,19 +625,42 @@ def parse_ga_period(lines):
     return period
 
 
+# GA4 CSVのヘッダー行を探す範囲（コメント行＋ヘッダー行が収まる行数）
+GA_HEADER_SCAN_LINES = 50
+
+# GA4 CSVのカラム名 → 内部カラム名（これ以外のカラムは読み込まない）
+GA_COL_MAP = {
+    'Item name': 'item_name',
+    'Item ID': 'sku_id',
+    'Items viewed': 'views',
+    'Items added to cart': 'add_to_cart',
+    'Items purchased': 'purchases',
+    'Item revenue': 'revenue',
+}
+
+
 def load_ga_sales(filepath):
+    """GA4売上CSVを読み込み、期間情報も返す（内容が同じなら前回の結果を使う）"""
+    result = load_csv_cached('ga_sales', filepath, parse_ga_sales)
+    # periodは呼び出し側で書き換えられるのでキャッシュとは別のdictにする
+    return {'data': result['data'], 'period': dict(result['period'])}
+
+
+def parse_ga_sales(filepath):
     """GA4売上CSVを読み込み、期間情報も返す"""
-    for enc in ['utf-8', 'utf-8-sig', 'cp932']:
+    for enc in candidate_encodings(filepath, ['utf-8', 'utf-8-sig', 'cp932']):
         try:
             # ヘッダー行をスキップ（GA4エクスポート形式対応）
+            # 先頭の数十行だけ読む（本体はread_csv_fastが読む）
             with open(filepath, 'r', encoding=enc) as f:
-                lines = f.readlines()
+                lines = list(islice(f, GA_HEADER_SCAN_LINES))
             
             # 期間情報を抽出
             period = parse_ga_period(lines)
             
             # データ開始行を探す（#コメント行をスキップ）
             header_idx = 0
+            usecols = None
             for i, line in enumerate(lines):
                 # #で始まるコメント行をスキップ
                 if line.strip().startswith('#'):
@@ -311,30 +668,28 @@ def load_ga_sales(filepath):
                 # Item nameまたはItem IDを含むヘッダー行を探す
                 if 'Item name' in line or 'Item ID' in line:
                     header_idx = i
+                    # 使うカラムだけ読み込む（ヘッダー行にあるものだけ指定する）
+                    header = next(csv.reader([line]))
+                    if 'Item ID' in header:
+                        usecols = [col for col in header if col in GA_COL_MAP]
                     break
             
-            df = pd.read_csv(filepath, encoding=enc, skiprows=header_idx)
+            df = read_csv_fast(filepath, encoding=enc, skiprows=header_idx, usecols=usecols, dtype=GA_CSV_DTYPES)
             
             # カラム名を正規化
-            col_map = {
-                'Item name': 'item_name',
-                'Item ID': 'sku_id',
-                'Items viewed': 'views',
-                'Items added to cart': 'add_to_cart',
-                'Items purchased': 'purchases',
-                'Item revenue': 'revenue',
-            }
-            existing_cols = {k: v for k, v in col_map.items() if k in df.columns}
+            existing_cols = {k: v for k, v in GA_COL_MAP.items() if k in df.columns}
             df = df.rename(columns=existing_cols)
             
             # sku_idが存在するか確認
             if 'sku_id' not in df.columns:
                 raise ValueError("Item ID column not found")
             
-            # 数値変換
-            for col in ['views', 'add_to_cart', 'purchases', 'revenue']:
+            # 数値変換（件数はint32、売上は金額の合計精度を保つためfloat64）
+            for col in ['views', 'add_to_cart', 'purchases']:
                 if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(np.int32)
+            if 'revenue' in df.columns:
+                df['revenue'] = pd.to_numeric(df['revenue'], errors='coerce').fillna(0)
             
             return {'data': df, 'period': period}
         except Exception as e:
@@ -394,9 +749,10 @@ def get_analysis_period():
     return overall
 
 
+@with_store_lock
 def switch_period_data(period_type):
     """
-    指定した期間のデータをメインストアにコピー
+    指定した期間のデータをメインストアに切り替え（dictはコピーせず参照を共有）
     merged_dataがない場合は分析を実行
     """
     if period_type not in data_store['periods_data']:
@@ -408,8 +764,8 @@ def switch_period_data(period_type):
     if period_data['merged_data'] is None and period_data['ga_sales']:
         print(f"[INFO] Analyzing {period_type} on switch...")
         # 一時的にメインストアにセット
-        data_store['ga_sales'] = period_data['ga_sales'].copy()
-        data_store['ga_sales_previous'] = period_data['ga_sales_previous'].copy()
+        data_store['ga_sales'] = period_data['ga_sales']
+        data_store['ga_sales_previous'] = period_data['ga_sales_previous']
         data_store['current_period'] = period_type
         # 分析実行
         merge_and_analyze()
@@ -418,11 +774,11 @@ def switch_period_data(period_type):
         period_data['merged_data_previous'] = data_store['merged_data_previous']
         print(f"[OK] Analyzed {period_type}")
     
-    # メインストアにコピー
-    data_store['ga_sales'] = period_data['ga_sales'].copy()
-    data_store['ga_sales_previous'] = period_data['ga_sales_previous'].copy()
-    data_store['channel_data'] = period_data['channel_data'].copy()
-    data_store['campaign_data'] = period_data.get('campaign_data', {}).copy()
+    # メインストアに参照をセット（periods_dataが所有者、メイン側は別名）
+    data_store['ga_sales'] = period_data['ga_sales']
+    data_store['ga_sales_previous'] = period_data['ga_sales_previous']
+    data_store['channel_data'] = period_data['channel_data']
+    data_store['campaign_data'] = period_data.get('campaign_data', {})
     data_store['merged_data'] = period_data['merged_data']
     data_store['merged_data_previous'] = period_data['merged_data_previous']
     data_store['current_period'] = period_type
@@ -430,6 +786,46 @@ def switch_period_data(period_type):
     return True
 
 
+# GAデータのSKU単位集計ルール
+GA_METRICS_AGG = {
+    'views': 'sum',
+    'add_to_cart': 'sum',
+    'purchases': 'sum',
+    'revenue': 'sum',
+}
+GA_AGG = {'item_name': 'first', **GA_METRICS_AGG}
+
+
+def aggregate_ga_frames(ga_list, agg_dict):
+    """GAデータをブランド別に先にSKU集計してから結合し、最後に全体で合算"""
+    # 結果はsku_idで商品マスタに結合するだけなので、sku_id文字列の並べ替えは行わない
+    partials = [df.groupby('sku_id', as_index=False, sort=False).agg(agg_dict) for df in ga_list]
+    if len(partials) == 1:
+        ga = partials[0]
+    else:
+        ga = pd.concat(partials, ignore_index=True).groupby('sku_id', as_index=False, sort=False).agg(agg_dict)
+    # R2から読んだCSVなどでsku_idが数値として読まれていても、文字列の商品マスタと突き合わせられるようにする
+    if not pd.api.types.is_object_dtype(ga['sku_id'].dtype):
+        ga['sku_id'] = ga['sku_id'].astype(str)
+    return ga
+
+
+def get_indexed_product_master(pm):
+    """sku_idをインデックスにした商品マスタを取得（商品マスタが変わるまで使い回す）"""
+    cached = data_store.get('product_master_indexed')
+    if cached is None or cached['source'] is not pm:
+        cached = {'source': pm, 'df': pm.set_index('sku_id', drop=False)}
+        data_store['product_master_indexed'] = cached
+    return cached['df']
+
+
+def join_product_master(pm, ga):
+    """商品マスタにSKU単位のGA集計をインデックス結合（左結合、商品マスタの行順を維持）"""
+    indexed = get_indexed_product_master(pm)
+    return indexed.join(ga.set_index('sku_id'), how='left').reset_index(drop=True)
+
+
+@with_store_lock
 def merge_and_analyze_for_period(period_type):
     """
     指定した期間のデータで分析を実行し、結果を期間別ストアに保存
@@ -460,20 +856,15 @@ def merge_and_analyze_for_period(period_type):
     if not ga_list:
         return None
     
-    ga = pd.concat(ga_list, ignore_index=True)
-    ga = ga.groupby('sku_id').agg({
-        'item_name': 'first',
-        'views': 'sum',
-        'add_to_cart': 'sum',
-        'purchases': 'sum',
-        'revenue': 'sum',
-    }).reset_index()
+    ga = aggregate_ga_frames(ga_list, GA_AGG)
     
-    merged = pm.merge(ga, on='sku_id', how='left')
-    merged['views'] = merged['views'].fillna(0).astype(int)
-    merged['add_to_cart'] = merged['add_to_cart'].fillna(0).astype(int)
-    merged['purchases'] = merged['purchases'].fillna(0).astype(int)
+    merged = join_product_master(pm, ga)
+    merged['views'] = merged['views'].fillna(0).astype(np.int32)
+    merged['add_to_cart'] = merged['add_to_cart'].fillna(0).astype(np.int32)
+    merged['purchases'] = merged['purchases'].fillna(0).astype(np.int32)
     merged['revenue'] = merged['revenue'].fillna(0)
+    # SKU単位のCVR（ランキング表示でリクエストごとに計算しないよう先に持たせる）
+    merged['cvr'] = safe_divide(merged['purchases'], merged['views'], 100)
     
     period_data['merged_data'] = merged
     
@@ -487,24 +878,91 @@ def merge_and_analyze_for_period(period_type):
                     ga_list_prev.append(df)
         
         if ga_list_prev:
-            ga_prev = pd.concat(ga_list_prev, ignore_index=True)
-            ga_prev = ga_prev.groupby('sku_id').agg({
-                'item_name': 'first',
-                'views': 'sum',
-                'add_to_cart': 'sum',
-                'purchases': 'sum',
-                'revenue': 'sum',
-            }).reset_index()
-            merged_prev = pm.merge(ga_prev, on='sku_id', how='left')
-            merged_prev['views'] = merged_prev['views'].fillna(0).astype(int)
-            merged_prev['add_to_cart'] = merged_prev['add_to_cart'].fillna(0).astype(int)
-            merged_prev['purchases'] = merged_prev['purchases'].fillna(0).astype(int)
+            ga_prev = aggregate_ga_frames(ga_list_prev, GA_AGG)
+            merged_prev = join_product_master(pm, ga_prev)
+            merged_prev['views'] = merged_prev['views'].fillna(0).astype(np.int32)
+            merged_prev['add_to_cart'] = merged_prev['add_to_cart'].fillna(0).astype(np.int32)
+            merged_prev['purchases'] = merged_prev['purchases'].fillna(0).astype(np.int32)
             merged_prev['revenue'] = merged_prev['revenue'].fillna(0)
             period_data['merged_data_previous'] = merged_prev
     
     return merged
 
 
+def safe_divide(numerator, denominator, scale=1):
+    """ゼロ除算を0として扱うベクトル化した割り算（分母が0以下なら0）"""
+    num = np.asarray(numerator, dtype=float)
+    den = np.asarray(denominator, dtype=float)
+    return np.divide(num, den, out=np.zeros_like(num), where=den > 0) * scale
+
+
+def delta_pct(current, previous):
+    """前期比(%)をベクトル計算（前期0なら今期>0で100、それ以外0）"""
+    cur = np.asarray(current, dtype=float)
+    prev = np.asarray(previous, dtype=float)
+    return np.where(prev > 0, safe_divide(cur - prev, prev, 100), np.where(cur > 0, 100.0, 0.0))
+
+
+# ブランド名（小文字・空白/アンダースコア除去後）に含まれる語 → 商品ページURLのブランド部分（上から順に判定）
+BRAND_SLUG_RULES = [
+    ('rady', 'rady'),
+    ('cherimi', 'cherimi'),
+    ('michell', 'michellmacaron'),
+    ('macaron', 'michellmacaron'),
+    ('solni', 'solni'),
+]
+
+
+def get_brand_slug(brand):
+    """ブランド名から商品ページURLのブランド部分を判定（該当なしは空文字）"""
+    normalized = str(brand).lower().replace(' ', '').replace('_', '')
+    for keyword, slug in BRAND_SLUG_RULES:
+        if keyword in normalized:
+            return slug
+    return ''
+
+
+def generate_product_urls(df):
+    """商品ページURLを自動生成（空の場合のみブランドとSKU IDから補完）"""
+    if 'product_url' in df.columns:
+        url = df['product_url']
+    else:
+        url = pd.Series(np.nan, index=df.index, dtype=object)
+    has_url = url.notna() & url.astype(str).str.strip().ne('')
+    
+    # ブランドの種類ごとに1回だけ判定し、行へは整数コードで割り当てる（欠損のコード-1は末尾の空文字を指す）
+    brand = df['brand'] if 'brand' in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+    codes, brands = pd.factorize(brand)
+    slugs = np.array([get_brand_slug(b) for b in brands] + [''], dtype=object)
+    brand_slug = pd.Series(slugs[codes], index=df.index)
+    
+    sku = df['sku_id'] if 'sku_id' in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+    can_generate = brand_slug.ne('') & sku.notna() & sku.astype(str).ne('')
+    generated = 'https://mycolor.jp/' + brand_slug + '/item/' + sku.astype(str)
+    
+    return url.where(has_url, generated.where(can_generate, ''))
+
+
+def get_merge_fingerprint(pm, ga_dict, ga_prev_dict):
+    """merge_and_analyzeの入力を識別するキーと、参照を保持する入力オブジェクトを返す"""
+    inputs = [pm]
+    key = [id(pm), len(pm)]
+    for label, source in (('current', ga_dict), ('previous', ga_prev_dict or {})):
+        for brand, info in sorted(source.items()):
+            if info and 'data' in info and info['data'] is not None:
+                inputs.append(info['data'])
+                key.append((label, brand, id(info['data']), len(info['data'])))
+    return tuple(key), inputs
+
+
+def invalidate_merge_cache():
+    """merge_and_analyzeのキャッシュを破棄"""
+    merge_cache['key'] = None
+    merge_cache['inputs'] = None
+    merge_cache['result'] = None
+
+
+@with_store_lock
 def merge_and_analyze():
     """商品マスタとGA売上を突き合わせて分析"""
     pm = data_store['product_master']
@@ -513,6 +971,12 @@ def merge_and_analyze():
     if pm is None or not ga_dict:
         return None
     
+    # 入力が前回と同じならキャッシュを返す
+    cache_key, cache_inputs = get_merge_fingerprint(pm, ga_dict, data_store.get('ga_sales_previous'))
+    if merge_cache['key'] == cache_key:
+        data_store['merged_data'] = merge_cache['result']
+        return merge_cache['result']
+    
     # 全ブランドのGAデータを結合
     required_cols = ['sku_id', 'views', 'add_to_cart', 'purchases', 'revenue']
     ga_list = []
@@ -529,75 +993,47 @@ def merge_and_analyze():
     if not ga_list:
         return None
     
-    ga = pd.concat(ga_list, ignore_index=True)
-    
     # 同じSKUが複数ブランドにある場合は合算
-    ga = ga.groupby('sku_id').agg({
-        'item_name': 'first',
-        'views': 'sum',
-        'add_to_cart': 'sum',
-        'purchases': 'sum',
-        'revenue': 'sum',
-    }).reset_index()
+    ga = aggregate_ga_frames(ga_list, GA_AGG)
     
     # SKU IDで結合
-    merged = pm.merge(ga, on='sku_id', how='left')
+    merged = join_product_master(pm, ga)
     
     # 商品ページURLを自動生成（空の場合）
-    def generate_product_url(row):
-        if pd.notna(row.get('product_url')) and str(row.get('product_url')).strip():
-            return row['product_url']
-        
-        brand_raw = str(row.get('brand', '')).lower().replace(' ', '').replace('_', '')
-        brand_slug = ''
-        if 'rady' in brand_raw:
-            brand_slug = 'rady'
-        elif 'cherimi' in brand_raw:
-            brand_slug = 'cherimi'
-        elif 'michell' in brand_raw or 'macaron' in brand_raw:
-            brand_slug = 'michellmacaron'
-        elif 'solni' in brand_raw:
-            brand_slug = 'solni'
-        
-        if brand_slug and row.get('sku_id'):
-            return f"https://mycolor.jp/{brand_slug}/item/{row['sku_id']}"
-        return ''
-    
-    merged['product_url'] = merged.apply(generate_product_url, axis=1)
+    merged['product_url'] = generate_product_urls(merged)
     
-    # 欠損値を0埋め
-    for col in ['views', 'add_to_cart', 'purchases', 'revenue']:
+    # 欠損値を0埋め（件数はint32、売上は金額の合計精度を保つためfloat64のまま）
+    for col in ['views', 'add_to_cart', 'purchases']:
         if col in merged.columns:
-            merged[col] = merged[col].fillna(0)
+            merged[col] = merged[col].fillna(0).astype(np.int32)
+    if 'revenue' in merged.columns:
+        merged['revenue'] = merged['revenue'].fillna(0)
     
     # 分析指標を追加
     # CVR（閲覧→購入率）
-    merged['cvr'] = merged.apply(
-        lambda x: (x['purchases'] / x['views'] * 100) if x['views'] > 0 else 0, axis=1
-    )
+    merged['cvr'] = safe_divide(merged['purchases'], merged['views'], 100)
     
     # カート追加率
-    merged['cart_rate'] = merged.apply(
-        lambda x: (x['add_to_cart'] / x['views'] * 100) if x['views'] > 0 else 0, axis=1
-    )
+    merged['cart_rate'] = safe_divide(merged['add_to_cart'], merged['views'], 100)
     
     # 在庫効率スコア（売上÷在庫、高いほど効率的）
-    merged['stock_efficiency'] = merged.apply(
-        lambda x: x['revenue'] / x['total_stock'] if x['total_stock'] > 0 else 0, axis=1
-    )
+    merged['stock_efficiency'] = safe_divide(merged['revenue'], merged['total_stock'])
+    
+    # 判定はNumPy配列で行う（pandasのインデックス整列を省く）
+    stock_arr = merged['total_stock'].to_numpy()
+    rev_arr = merged['revenue'].to_numpy()
+    views_arr = merged['views'].to_numpy()
+    has_rows = len(merged) > 0
     
     # 問題フラグ: 在庫多い × 売上少ない
-    stock_threshold = merged['total_stock'].quantile(0.7)  # 上位30%の在庫
-    revenue_threshold = merged['revenue'].quantile(0.3)    # 下位30%の売上
+    stock_threshold = np.quantile(stock_arr, 0.7) if has_rows else np.nan  # 上位30%の在庫
+    revenue_threshold = np.quantile(rev_arr, 0.3) if has_rows else np.nan  # 下位30%の売上
     
-    merged['is_problem'] = (merged['total_stock'] >= stock_threshold) & (merged['revenue'] <= revenue_threshold)
+    merged['is_problem'] = (stock_arr >= stock_threshold) & (rev_arr <= revenue_threshold)
     
     # 機会損失フラグ: 閲覧多い × 在庫少ない × 購入少ない
-    views_threshold = merged['views'].quantile(0.7)
-    merged['is_opportunity'] = (merged['views'] >= views_threshold) & (merged['total_stock'] <= 5) & (merged['purchases'] < merged['views'] * 0.05)
-    
-    # Regalectを除外
-    merged = merged[merged['brand'] != 'Regalect']
+    views_threshold = np.quantile(views_arr, 0.7) if has_rows else np.nan
+    merged['is_opportunity'] = (views_arr >= views_threshold) & (stock_arr <= 5) & (merged['purchases'].to_numpy() < views_arr * 0.05)
     
     # 前期間データとの比較（デルタ計算）
     ga_prev_dict = data_store.get('ga_sales_previous', {})
@@ -611,17 +1047,11 @@ def merge_and_analyze():
                     ga_prev_list.append(df)
         
         if ga_prev_list:
-            ga_prev = pd.concat(ga_prev_list, ignore_index=True)
-            ga_prev = ga_prev.groupby('sku_id').agg({
-                'views': 'sum',
-                'add_to_cart': 'sum',
-                'purchases': 'sum',
-                'revenue': 'sum',
-            }).reset_index()
+            ga_prev = aggregate_ga_frames(ga_prev_list, GA_METRICS_AGG)
             ga_prev.columns = ['sku_id', 'prev_views', 'prev_add_to_cart', 'prev_purchases', 'prev_revenue']
             
-            # 前期間データをマージ
-            merged = merged.merge(ga_prev, on='sku_id', how='left')
+            # 前期間データをマージ（集計済みでsku_idは一意、重複があれば行が増える前にエラーにする）
+            merged = merged.merge(ga_prev, on='sku_id', how='left', validate='many_to_one')
             
             # デルタ計算
             for col in ['views', 'add_to_cart', 'purchases', 'revenue']:
@@ -631,20 +1061,21 @@ def merge_and_analyze():
                 
                 merged[prev_col] = merged[prev_col].fillna(0)
                 merged[delta_col] = merged[col] - merged[prev_col]
-                merged[pct_col] = merged.apply(
-                    lambda x: ((x[col] - x[prev_col]) / x[prev_col] * 100) if x[prev_col] > 0 else (100 if x[col] > 0 else 0),
-                    axis=1
-                )
+                merged[pct_col] = delta_pct(merged[col], merged[prev_col])
             
             # CVRのデルタ
-            merged['prev_cvr'] = merged.apply(
-                lambda x: (x['prev_purchases'] / x['prev_views'] * 100) if x['prev_views'] > 0 else 0, axis=1
-            )
+            merged['prev_cvr'] = safe_divide(merged['prev_purchases'], merged['prev_views'], 100)
             merged['delta_cvr'] = merged['cvr'] - merged['prev_cvr']
             
             print(f"[OK] Calculated deltas for {len(merged)} items")
     
+    merge_cache['key'] = cache_key
+    merge_cache['inputs'] = cache_inputs
+    merge_cache['result'] = merged
+    
     data_store['merged_data'] = merged
+    data_store['precomputed'] = build_precomputed(merged)
+    data_store['dashboard'] = build_dashboard_data(merged)
     return merged
 
 
@@ -654,9 +1085,6 @@ def get_brand_summary():
     if df is None:
         return None
     
-    # Regalectを除外
-    df = df[df['brand'] != 'Regalect']
-    
     # 集計カラムの準備
     agg_dict = {
         'sku_id': 'count',
@@ -677,7 +1105,7 @@ def get_brand_summary():
         agg_dict['prev_add_to_cart'] = 'sum'
         agg_dict['prev_purchases'] = 'sum'
     
-    summary = df.groupby('brand').agg(agg_dict).reset_index()
+    summary = df.groupby('brand', observed=True).agg(agg_dict).reset_index()
     
     # カラム名を変更
     base_cols = ['brand', 'sku_count', 'total_stock', 'total_views', 
@@ -688,134 +1116,239 @@ def get_brand_summary():
     summary.columns = base_cols
     
     # CVR計算
-    summary['overall_cvr'] = summary.apply(
-        lambda x: (x['total_purchases'] / x['total_views'] * 100) if x['total_views'] > 0 else 0, axis=1
-    )
+    summary['overall_cvr'] = safe_divide(summary['total_purchases'], summary['total_views'], 100)
     
-    # デルタ計算（前期間データがある場合）
+    # デルタ計算（前期間データがある場合、前期0なら増減率は0）
     if has_prev:
         # 売上デルタ
         summary['delta_revenue'] = summary['total_revenue'] - summary['prev_total_revenue']
-        summary['delta_revenue_pct'] = summary.apply(
-            lambda x: ((x['total_revenue'] - x['prev_total_revenue']) / x['prev_total_revenue'] * 100) 
-                      if x['prev_total_revenue'] > 0 else 0, axis=1
-        )
+        summary['delta_revenue_pct'] = safe_divide(summary['delta_revenue'], summary['prev_total_revenue'], 100)
         # PVデルタ
         summary['delta_views'] = summary['total_views'] - summary['prev_total_views']
-        summary['delta_views_pct'] = summary.apply(
-            lambda x: ((x['total_views'] - x['prev_total_views']) / x['prev_total_views'] * 100) 
-                      if x['prev_total_views'] > 0 else 0, axis=1
-        )
+        summary['delta_views_pct'] = safe_divide(summary['delta_views'], summary['prev_total_views'], 100)
         # 購入デルタ
         summary['delta_purchases'] = summary['total_purchases'] - summary['prev_total_purchases']
-        summary['delta_purchases_pct'] = summary.apply(
-            lambda x: ((x['total_purchases'] - x['prev_total_purchases']) / x['prev_total_purchases'] * 100) 
-                      if x['prev_total_purchases'] > 0 else 0, axis=1
-        )
+        summary['delta_purchases_pct'] = safe_divide(summary['delta_purchases'], summary['prev_total_purchases'], 100)
         # カート追加デルタ
         summary['delta_add_to_cart'] = summary['total_add_to_cart'] - summary['prev_total_add_to_cart']
-        summary['delta_add_to_cart_pct'] = summary.apply(
-            lambda x: ((x['total_add_to_cart'] - x['prev_total_add_to_cart']) / x['prev_total_add_to_cart'] * 100) 
-                      if x['prev_total_add_to_cart'] > 0 else 0, axis=1
-        )
+        summary['delta_add_to_cart_pct'] = safe_divide(summary['delta_add_to_cart'], summary['prev_total_add_to_cart'], 100)
     
     return summary.to_dict('records')
 
 
-def get_problem_products(brand=None, limit=50):
-    """問題商品（在庫過多×低売上）を取得"""
-    df = data_store['merged_data']
-    if df is None:
-        return []
+def detect_anomalies(df):
+    """
+    異常値検出：急上昇商品と要注意商品のDataFrameを返す（スコア順）
+    - 急上昇: PVまたは購入が前期比+50%以上かつ一定以上の実績
+    - 要注意: 在庫あるのにPVまたは購入が前期比-30%以上
+    """
+    # スコア（上昇・下落の度合い）は全行分をNumPy配列で一度だけ計算
+    score = (
+        df['delta_views_pct'].fillna(0).to_numpy(dtype=float) * 0.3 +
+        df['delta_purchases_pct'].fillna(0).to_numpy(dtype=float) * 0.5 +
+        df['delta_revenue_pct'].fillna(0).to_numpy(dtype=float) * 0.2
+    )
     
-    filtered = df[df['is_problem'] == True].copy()
-    if brand and brand != 'all':
-        filtered = filtered[filtered['brand'] == brand]
+    # 🔥 急上昇商品
+    # 条件: (PV+50%以上 AND 今期PV>=50) OR (購入+50%以上 AND 今期購入>=3)
+    rising_condition = (
+        ((df['delta_views_pct'] >= 50) & (df['views'] >= 50)) |
+        ((df['delta_purchases_pct'] >= 50) & (df['purchases'] >= 3))
+    )
+    # スコアの高い順（同点は元の順序）
+    rising_idx = np.flatnonzero(rising_condition.to_numpy())
+    rising_idx = rising_idx[np.argsort(-score[rising_idx], kind='stable')]
+    rising = df.iloc[rising_idx].copy()
+    rising['rise_score'] = score[rising_idx]
     
-    filtered = filtered.sort_values('total_stock', ascending=False).head(limit)
-    return filtered.to_dict('records')
+    # ⚠️ 要注意商品（在庫あるのに落ちている）
+    # 条件: 在庫>0 AND ((PV-30%以上 AND 前期PV>=30) OR (購入-30%以上 AND 前期購入>=2))
+    warning_condition = (
+        (df['total_stock'] > 0) &
+        (
+            ((df['delta_views_pct'] <= -30) & (df['prev_views'] >= 30)) |
+            ((df['delta_purchases_pct'] <= -30) & (df['prev_purchases'] >= 2))
+        )
+    )
+    # スコアの低い順（下落率の大きい順、マイナスなので小さい方が悪い）
+    warning_idx = np.flatnonzero(warning_condition.to_numpy())
+    warning_idx = warning_idx[np.argsort(score[warning_idx], kind='stable')]
+    warning = df.iloc[warning_idx].copy()
+    warning['warn_score'] = score[warning_idx]
+    
+    return rising, warning
+
+
+# get_ranked_recordsで保持するdictリストの最大件数（limitは任意の値を受け付けるため上限を設ける）
+RANKED_RECORDS_CACHE_SIZE = 64
+
+# build_precomputedの世代番号（プロセス内で単調増加）
+precomputed_versions = count(1)
+
+
+def build_precomputed(merged):
+    """マージ結果から一覧表示用のソート済みスライスを作成（リクエストごとの再ソートを省く）"""
+    precomputed = {
+        'source': merged,
+        'version': next(precomputed_versions),  # 作り直すたびに増える世代番号（APIのETagに使う）
+        'problem_sorted': merged[merged['is_problem']].sort_values('total_stock', ascending=False, kind='stable'),
+        'opportunity_sorted': merged[merged['is_opportunity']].sort_values('views', ascending=False, kind='stable'),
+        'top_sorted': merged.sort_values('revenue', ascending=False, kind='stable'),
+        'brands': merged['brand'].dropna().unique().tolist(),
+        'brand_slices': {},  # (スライス名, ブランド)ごとの絞り込み結果（get_ranked_slice参照）
+        'records': {},  # (スライス名, ブランド, 件数)ごとのdictリスト（get_ranked_records参照）
+        'brand_stats': build_brand_stats(merged),
+        'rising': None,
+        'warning': None,
+    }
+    if 'delta_views_pct' in merged.columns:
+        precomputed['rising'], precomputed['warning'] = detect_anomalies(merged)
+    return precomputed
 
 
-def get_opportunity_products(brand=None, limit=50):
-    """機会損失商品（閲覧多×在庫切れ）を取得"""
-    df = data_store['merged_data']
-    if df is None:
-        return []
+def compute_brand_stats(brand_df):
+    """ブランド詳細画面の統計を計算"""
+    return {
+        'total_sku': len(brand_df),
+        'total_stock': int(brand_df['total_stock'].sum()),
+        'total_revenue': float(brand_df['revenue'].sum()),
+        'total_views': int(brand_df['views'].sum()),
+        'avg_cvr': float(brand_df['cvr'].mean()),
+        'problem_count': int(brand_df['is_problem'].sum()),
+        'opportunity_count': int(brand_df['is_opportunity'].sum()),
+    }
+
+
+def build_brand_stats(merged):
+    """全体（キーNone）とブランド別の統計をまとめて作成"""
+    stats = {None: compute_brand_stats(merged)}
+    for brand, group in merged.groupby('brand', sort=False, observed=True):
+        stats[brand] = compute_brand_stats(group)
+    return stats
+
+
+def get_brand_stats(brand=None):
+    """ブランド詳細画面の統計を取得（マージ結果にないブランドはその場で計算）"""
+    precomputed = get_precomputed()
+    key = brand if brand and brand != 'all' else None
+    stats = precomputed['brand_stats'].get(key)
+    if stats is None:
+        stats = compute_brand_stats(filter_brand(data_store['merged_data'], brand))
+    return stats
+
+
+def get_precomputed():
+    """現在のmerged_dataに対応するソート済みスライスを取得（期間切替などで古ければ作り直す）"""
+    merged = data_store['merged_data']
+    if merged is None:
+        return None
     
-    filtered = df[df['is_opportunity'] == True].copy()
+    precomputed = data_store.get('precomputed')
+    if precomputed is None or precomputed['source'] is not merged:
+        precomputed = build_precomputed(merged)
+        data_store['precomputed'] = precomputed
+    return precomputed
+
+
+def filter_brand(df, brand, cols=None):
+    """ブランドで絞り込み（None/'all'はそのまま、colsを渡すと絞り込みと同時に列も絞る）"""
     if brand and brand != 'all':
-        filtered = filtered[filtered['brand'] == brand]
-    
-    filtered = filtered.sort_values('views', ascending=False).head(limit)
-    return filtered.to_dict('records')
+        # category型の==は整数コード同士で比較される
+        mask = df['brand'] == brand
+        return df.loc[mask, cols] if cols is not None else df[mask]
+    return df
+
+
+def get_ranked_slice(name, brand=None, limit=50):
+    """ソート済みスライス（problem_sorted等）をブランドで絞り込み、上位limit件を返す"""
+    precomputed = get_precomputed()
+    if precomputed is None:
+        return None
+    if not brand or brand == 'all':
+        return precomputed[name].head(limit)
+    # ブランドで絞ったスライスは既知のブランドだけ使い回す（任意の文字列でキャッシュを増やさない）
+    key = (name, brand)
+    sliced = precomputed['brand_slices'].get(key)
+    if sliced is None:
+        sliced = filter_brand(precomputed[name], brand)
+        if brand in precomputed['brands']:
+            precomputed['brand_slices'][key] = sliced
+    return sliced.head(limit)
+
+
+def df_to_json_bytes(df, cols=None):
+    """DataFrameを列指向JSON（{列名: [値, ...]}）のバイト列にシリアライズ"""
+    payload = {}
+    for col in cols or df.columns:
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+            # 数値・真偽値はNumPy配列のままorjsonに渡す（NaNはnullになる）
+            payload[str(col)] = np.ascontiguousarray(series.to_numpy())
+        else:
+            payload[str(col)] = series.astype(object).where(series.notna(), None).tolist()
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def records_to_columns(records, nested_key=None):
+    """dictのリストを列指向（{キー: [値, ...]}）に変換（nested_keyのリストも列指向にする）"""
+    if not records:
+        return {}
+    columns = {key: [r[key] for r in records] for key in records[0]}
+    if nested_key in columns:
+        columns[nested_key] = [records_to_columns(items) for items in columns[nested_key]]
+    return columns
+
+
+def frame_to_records(dataframe):
+    """DataFrameをdictのリストに変換（列ごとにPythonの値へ変換してからzipで組み立てる）"""
+    columns = list(dataframe.columns)
+    values = [dataframe[col].tolist() for col in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def get_ranked_records(name, brand=None, limit=50):
+    """ソート済みスライスの上位limit件をdictのリストで取得（同じ条件なら前回のリストを返す、呼び出し側で書き換えないこと）"""
+    precomputed = get_precomputed()
+    if precomputed is None:
+        return []
+    key = (name, brand if brand and brand != 'all' else None, limit)
+    records = precomputed['records'].get(key)
+    if records is None:
+        records = frame_to_records(get_ranked_slice(name, brand, limit))
+        if len(precomputed['records']) < RANKED_RECORDS_CACHE_SIZE:
+            precomputed['records'][key] = records
+    return records
+
+
+def get_problem_products(brand=None, limit=50):
+    """問題商品（在庫過多×低売上）を取得"""
+    return get_ranked_records('problem_sorted', brand, limit)
+
+
+def get_opportunity_products(brand=None, limit=50):
+    """機会損失商品（閲覧多×在庫切れ）を取得"""
+    return get_ranked_records('opportunity_sorted', brand, limit)
 
 
 def get_top_performers(brand=None, limit=30):
     """売上上位商品を取得（カラー/サイズ別）"""
-    df = data_store['merged_data']
-    if df is None:
-        return []
-    
-    filtered = df.copy()
-    if brand and brand != 'all':
-        filtered = filtered[filtered['brand'] == brand]
-    
-    filtered = filtered.sort_values('revenue', ascending=False).head(limit)
-    return filtered.to_dict('records')
+    return get_ranked_records('top_sorted', brand, limit)
 
 
 def get_anomalies(brand=None, limit=20):
     """
-    異常値検出：急上昇商品と要注意商品を取得
-    - 急上昇: PVまたは購入が前期比+50%以上かつ一定以上の実績
-    - 要注意: 在庫あるのにPVまたは購入が前期比-30%以上
+    異常値検出：急上昇商品と要注意商品を取得（判定条件はdetect_anomalies参照）
     """
-    df = data_store['merged_data']
-    if df is None:
+    precomputed = get_precomputed()
+    if precomputed is None:
         return {'rising': [], 'warning': []}
     
     # デルタデータがなければ空を返す
-    if 'delta_views_pct' not in df.columns:
+    if precomputed['rising'] is None:
         return {'rising': [], 'warning': []}
     
-    filtered = df.copy()
-    if brand and brand != 'all':
-        filtered = filtered[filtered['brand'] == brand]
-    
-    # 🔥 急上昇商品
-    # 条件: (PV+50%以上 AND 今期PV>=50) OR (購入+50%以上 AND 今期購入>=3)
-    rising_condition = (
-        ((filtered['delta_views_pct'] >= 50) & (filtered['views'] >= 50)) |
-        ((filtered['delta_purchases_pct'] >= 50) & (filtered['purchases'] >= 3))
-    )
-    rising = filtered[rising_condition].copy()
-    
-    # スコア計算（上昇率の高い順）
-    rising['rise_score'] = (
-        rising['delta_views_pct'].fillna(0) * 0.3 +
-        rising['delta_purchases_pct'].fillna(0) * 0.5 +
-        rising['delta_revenue_pct'].fillna(0) * 0.2
-    )
-    rising = rising.sort_values('rise_score', ascending=False).head(limit)
-    
-    # ⚠️ 要注意商品（在庫あるのに落ちている）
-    # 条件: 在庫>0 AND ((PV-30%以上 AND 前期PV>=30) OR (購入-30%以上 AND 前期購入>=2))
-    warning_condition = (
-        (filtered['total_stock'] > 0) &
-        (
-            ((filtered['delta_views_pct'] <= -30) & (filtered['prev_views'] >= 30)) |
-            ((filtered['delta_purchases_pct'] <= -30) & (filtered['prev_purchases'] >= 2))
-        )
-    )
-    warning = filtered[warning_condition].copy()
-    
-    # スコア計算（下落率の大きい順、マイナスなので小さい方が悪い）
-    warning['warn_score'] = (
-        warning['delta_views_pct'].fillna(0) * 0.3 +
-        warning['delta_purchases_pct'].fillna(0) * 0.5 +
-        warning['delta_revenue_pct'].fillna(0) * 0.2
-    )
-    warning = warning.sort_values('warn_score', ascending=True).head(limit)
+    rising = filter_brand(precomputed['rising'], brand).head(limit)
+    warning = filter_brand(precomputed['warning'], brand).head(limit)
     
     # 必要なカラムだけ抽出して辞書に変換
     cols = ['sku_id', 'brand', 'product_name', 'color_name', 'size', 'image_url', 'product_url',
@@ -823,20 +1356,21 @@ def get_anomalies(brand=None, limit=20):
             'purchases', 'prev_purchases', 'delta_purchases', 'delta_purchases_pct',
             'revenue', 'prev_revenue', 'delta_revenue', 'delta_revenue_pct', 'cvr']
     
+    text_cols = {'sku_id', 'brand', 'product_name', 'color_name', 'size', 'image_url', 'product_url'}
+    
     def safe_to_dict(dataframe):
-        result = []
-        for _, row in dataframe.iterrows():
-            item = {}
-            for col in cols:
-                if col in row.index:
-                    val = row[col]
-                    if pd.isna(val):
-                        val = 0 if col not in ['sku_id', 'brand', 'product_name', 'color_name', 'size', 'image_url', 'product_url'] else ''
-                    item[col] = val
+        # 欠損値は列単位でまとめて埋める（文字列は''、数値は0）
+        columns = {}
+        for col in cols:
+            if col in dataframe.columns:
+                series = dataframe[col]
+                if col in text_cols:
+                    columns[col] = series.astype(object).where(series.notna(), '')
                 else:
-                    item[col] = 0 if col not in ['sku_id', 'brand', 'product_name', 'color_name', 'size', 'image_url', 'product_url'] else ''
-            result.append(item)
-        return result
+                    columns[col] = series.fillna(0)
+            else:
+                columns[col] = '' if col in text_cols else 0
+        return pd.DataFrame(columns, index=dataframe.index).to_dict('records')
     
     return {
         'rising': safe_to_dict(rising),
@@ -883,17 +1417,23 @@ def process_channel_data(channel_info):
         }).reset_index()
         prev_summary = prev_summary.set_index('channel')
     
-    # 詳細ソースを取得（チャネルごと）
-    source_details = {}
-    for channel in current_df['channel'].unique():
-        sources = current_df[current_df['channel'] == channel].groupby('source').agg({
-            'sessions': 'sum',
-            'users': 'sum',
-            'purchases': 'sum',
-            'revenue': 'sum',
-        }).reset_index()
-        sources = sources.sort_values('revenue', ascending=False).head(5)
-        source_details[channel] = sources.to_dict('records')
+    # 詳細ソースを取得（チャネル×ソースを1回で集計し、チャネルごとに売上上位5件）
+    sources = current_df.groupby(['channel', 'source'], as_index=False).agg({
+        'sessions': 'sum',
+        'users': 'sum',
+        'purchases': 'sum',
+        'revenue': 'sum',
+    })
+    sources = sources.sort_values(['channel', 'revenue'], ascending=[True, False], kind='stable')
+    sources = sources.groupby('channel', sort=False).head(5)
+    source_details = {
+        channel: group.drop(columns='channel').to_dict('records')
+        for channel, group in sources.groupby('channel', sort=False)
+    }
+    
+    # チャネル名・ソース名の日本語化はユニーク値ごとに1回だけ行う
+    channel_names = {c: translate_channel_name(c) for c in channel_summary['channel'].unique()}
+    source_names = {s: translate_source_name(s) for s in current_df['source'].unique()}
     
     # 結果を整形
     results = []
@@ -901,7 +1441,7 @@ def process_channel_data(channel_info):
         channel = row['channel']
         item = {
             'channel': channel,
-            'channel_ja': translate_channel_name(channel),
+            'channel_ja': channel_names[channel],
             'sessions': int(row['sessions']),
             'users': int(row['users']),
             'purchases': int(row['purchases']),
@@ -951,7 +1491,7 @@ def process_channel_data(channel_info):
         if channel in source_details:
             for src in source_details[channel]:
                 item['sources'].append({
-                    'name': translate_source_name(src['source']),
+                    'name': source_names[src['source']],
                     'sessions': int(src['sessions']),
                     'purchases': int(src['purchases']),
                     'revenue': float(src['revenue']),
@@ -964,6 +1504,15 @@ def process_channel_data(channel_info):
     return results
 
 
+def add_ad_type(df, classify_ad_type):
+    """広告タイプ列を追加したコピーを返す（行ごとのapplyではなく列をzipして分類し、同じ組み合わせは1回だけ分類）"""
+    df = df.copy()
+    keys = list(zip(df['campaign'].tolist(), df['source'].tolist(), df['medium'].tolist()))
+    ad_types = {key: classify_ad_type(*key) for key in set(keys)}
+    df['ad_type'] = [ad_types[key] for key in keys]
+    return df
+
+
 def process_campaign_data(campaign_info):
     """
     キャンペーンデータを広告タイプ別に整形
@@ -984,11 +1533,7 @@ def process_campaign_data(campaign_info):
         return []
     
     # 広告タイプを分類
-    current_df = current_df.copy()
-    current_df['ad_type'] = current_df.apply(
-        lambda row: classify_ad_type(row['campaign'], row['source'], row['medium']),
-        axis=1
-    )
+    current_df = add_ad_type(current_df, classify_ad_type)
     
     # 広告タイプがNoneは除外（オーガニックなど）
     ad_df = current_df[current_df['ad_type'].notna()]
@@ -1007,11 +1552,7 @@ def process_campaign_data(campaign_info):
     # 前期間データの処理
     prev_summary = None
     if prev_df is not None and len(prev_df) > 0:
-        prev_df = prev_df.copy()
-        prev_df['ad_type'] = prev_df.apply(
-            lambda row: classify_ad_type(row['campaign'], row['source'], row['medium']),
-            axis=1
-        )
+        prev_df = add_ad_type(prev_df, classify_ad_type)
         prev_ad_df = prev_df[prev_df['ad_type'].notna()]
         if len(prev_ad_df) > 0:
             prev_summary = prev_ad_df.groupby('ad_type').agg({
@@ -1092,106 +1633,211 @@ def process_campaign_data(campaign_info):
     return results
 
 
+# get_pv_rankingでキャッシュする(brand, limit)の組み合わせ数の上限
+PV_RANKING_CACHE_SIZE = 64
+
+# PVランキングのSKU詳細に載せる項目（カラム名, 型, 欠損・空文字のときの値）
+SKU_DETAIL_FIELDS = [
+    ('color_name', str, ''),
+    ('color_tag', str, '#888'),
+    ('size', str, ''),
+    ('views', int, 0),
+    ('add_to_cart', int, 0),
+    ('purchases', int, 0),
+    ('cvr', float, 0.0),
+    ('total_stock', int, 0),
+    # デルタ情報
+    ('delta_purchases', int, 0),
+    ('delta_purchases_pct', float, 0.0),
+    ('delta_add_to_cart', int, 0),
+    ('delta_cvr', float, 0.0),
+    ('prev_purchases', int, 0),
+]
+
+
+# PVランキングの集計・SKU詳細で使うカラム（それ以外は絞り込み時に落とす）
+PV_PRODUCT_COLS = ['product_class_id', 'brand', 'product_name', 'image_url', 'product_url',
+                   'views', 'add_to_cart', 'purchases', 'revenue', 'total_stock']
+PV_RANKING_COLS = PV_PRODUCT_COLS + [col for col, _, _ in SKU_DETAIL_FIELDS if col not in PV_PRODUCT_COLS]
+
+
+def build_sku_table(df):
+    """SKU詳細用のカラムを型・既定値をそろえて作成（CVRはマージ時の値、なければ列単位で計算）"""
+    table = pd.DataFrame(index=df.index)
+    for col, kind, default in SKU_DETAIL_FIELDS:
+        if col == 'cvr' and col not in df.columns:
+            table[col] = safe_divide(df['purchases'], df['views'], 100)
+        elif col not in df.columns:
+            table[col] = default
+        elif kind is str:
+            values = df[col].astype(str)
+            table[col] = values.where(values != '', default)
+        elif kind is int:
+            table[col] = df[col].fillna(0).astype(np.int64)
+        else:
+            table[col] = df[col].fillna(0).astype(np.float64)
+    return table
+
+
+# ダッシュボードに表示するブランドごとのPVランキング件数
+DASHBOARD_PV_LIMIT = 30
+
+
+def build_dashboard_data(merged):
+    """ダッシュボード用の集計（ブランド別サマリー・ブランド別PVランキング）を作成"""
+    return {
+        'source': merged,
+        'summary': get_brand_summary(),
+        'pv_ranking_by_brand': get_pv_ranking_by_brand(limit_per_brand=DASHBOARD_PV_LIMIT),
+    }
+
+
+def get_dashboard_data():
+    """現在のmerged_dataに対応するダッシュボード集計を取得（期間切替などで古ければ作り直す）"""
+    merged = data_store['merged_data']
+    if merged is None:
+        return None
+    
+    dashboard = data_store.get('dashboard')
+    if dashboard is None or dashboard['source'] is not merged:
+        dashboard = build_dashboard_data(merged)
+        data_store['dashboard'] = dashboard
+    return dashboard
+
+
+def get_pv_ranking_cache(df):
+    """merged_dataに対応するPVランキングのキャッシュを取得（差し替わっていたら作り直す）
+    results: (brand, limit)ごとのランキング / skus: product_class_idごとのSKU詳細リスト
+    """
+    cache = data_store.get('pv_ranking_cache')
+    if cache is None or cache['source'] is not df:
+        cache = {'source': df, 'results': {}, 'skus': {}}
+        data_store['pv_ranking_cache'] = cache
+    return cache
+
+
 def get_pv_ranking(brand=None, limit=50):
-    """PV（閲覧数）ランキングを取得（商品名でグループ化、SKU詳細付き）"""
+    """PV（閲覧数）ランキングを取得（merged_dataごとに結果をキャッシュ、返り値は書き換えないこと）"""
     df = data_store['merged_data']
     if df is None:
         return []
     
-    # ブランドフィルタ
-    if brand and brand != 'all':
-        df = df[df['brand'] == brand].copy()
-    else:
-        df = df.copy()
-    
+    cache = get_pv_ranking_cache(df)
+    key = (brand if brand and brand != 'all' else None, limit)
+    result = cache['results'].get(key)
+    if result is None:
+        result = build_pv_ranking(df, brand, limit, cache['skus'])
+        if len(cache['results']) < PV_RANKING_CACHE_SIZE:
+            cache['results'][key] = result
+    return result
+
+
+def build_pv_ranking(df, brand=None, limit=50, sku_cache=None):
+    """PV（閲覧数）ランキングを作成（商品名でグループ化、SKU詳細付き）"""
     # 商品名（product_class_id）でグループ化して集計
     if 'product_class_id' not in df.columns:
         return []
     
-    # 閲覧数が0より大きい商品のみ（グループ集計前）
-    products_with_views = df[df['views'] > 0]['product_class_id'].unique()
+    # ブランドフィルタ（使うカラムだけ取り出す、全ブランドのときは書き込まないのでコピーしない）
+    df = filter_brand(df, brand, [col for col in PV_RANKING_COLS if col in df.columns])
     
-    grouped = df.groupby('product_class_id').agg({
-        'brand': 'first',
-        'product_name': 'first',
-        'image_url': 'first',
-        'product_url': 'first',
-        'views': 'first',  # GA4のPVは商品名レベルで同じ値
-        'add_to_cart': 'sum',
-        'purchases': 'sum',
-        'revenue': 'sum',
-        'total_stock': 'sum',
-    }).reset_index()
+    # 上位limit件だけ必要なので全件ソートせずnlargestで取る（同数は先に出た方が優先）
+    grouped = aggregate_pv_products(df).nlargest(limit, 'views')
+    return attach_pv_skus(df, grouped, sku_cache)
+
+
+def aggregate_pv_products(df):
+    """商品（product_class_id）単位に集計（閲覧のある商品のみ、並び順はproduct_class_id順）"""
+    grouped = df.groupby('product_class_id', observed=True).agg(
+        brand=('brand', 'first'),
+        product_name=('product_name', 'first'),
+        image_url=('image_url', 'first'),
+        product_url=('product_url', 'first'),
+        views=('views', 'first'),  # GA4のPVは商品名レベルで同じ値
+        max_views=('views', 'max'),
+        add_to_cart=('add_to_cart', 'sum'),
+        purchases=('purchases', 'sum'),
+        revenue=('revenue', 'sum'),
+        total_stock=('total_stock', 'sum'),
+    ).reset_index()
     
-    # PVがある商品のみ
-    grouped = grouped[grouped['product_class_id'].isin(products_with_views)]
+    # 閲覧数が0より大きいSKUを含む商品のみ（集計と同じパスで判定）
+    grouped = grouped[grouped['max_views'] > 0].drop(columns='max_views')
     
     # CVR（PVに対する購入率）= 購入数 / PV * 100
-    grouped['cvr'] = (grouped['purchases'].astype(float) / grouped['views'].astype(float) * 100).fillna(0)
+    grouped['cvr'] = safe_divide(grouped['purchases'], grouped['views'], 100)
     grouped['purchase_rate'] = grouped['cvr']
     
-    grouped = grouped.sort_values('views', ascending=False).head(limit)
+    return grouped
+
+
+def attach_pv_skus(df, grouped, sku_cache=None):
+    """集計済みの商品をdictにし、各商品のSKU詳細を付ける（sku_cacheにあるSKU詳細は作り直さない）"""
+    if sku_cache is None:
+        sku_cache = {}
     
-    # SKU詳細を追加（元のdfから取得）
-    result = []
-    for _, row in grouped.iterrows():
-        product = row.to_dict()
+    # SKU詳細がまだない商品だけ、dfから作ってsku_cacheに入れる
+    missing = [pcid for pcid in grouped['product_class_id'] if pcid not in sku_cache]
+    if missing:
+        build_sku_lists(df, missing, sku_cache)
+    
+    result = frame_to_records(grouped)
+    for product in result:
         # CVRを確実にfloatで保持
         product['cvr'] = float(product.get('cvr', 0) or 0)
-        
-        # このproduct_class_idに属する全SKUを取得（元データから）
-        skus = df[df['product_class_id'] == row['product_class_id']].copy()
-        
-        if len(skus) > 0:
-            # 各SKUのCVRを計算
-            skus['cvr'] = skus.apply(
-                lambda x: (float(x['purchases']) / float(x['views']) * 100) if float(x['views']) > 0 else 0.0, axis=1
-            )
-            
-            # 購入数の多い順にソート（優れている順）
-            skus = skus.sort_values('purchases', ascending=False)
-            
-            # SKUデータを辞書リストに変換（デルタ情報も含む）
-            sku_list = []
-            for _, s in skus.iterrows():
-                sku_data = {
-                    'color_name': str(s.get('color_name', '') or ''),
-                    'color_tag': str(s.get('color_tag', '#888') or '#888'),
-                    'size': str(s.get('size', '') or ''),
-                    'views': int(s.get('views', 0) or 0),
-                    'add_to_cart': int(s.get('add_to_cart', 0) or 0),
-                    'purchases': int(s.get('purchases', 0) or 0),
-                    'cvr': float(s.get('cvr', 0) or 0),
-                    'total_stock': int(s.get('total_stock', 0) or 0),
-                    # デルタ情報
-                    'delta_purchases': int(s.get('delta_purchases', 0) or 0),
-                    'delta_purchases_pct': float(s.get('delta_purchases_pct', 0) or 0),
-                    'delta_add_to_cart': int(s.get('delta_add_to_cart', 0) or 0),
-                    'delta_cvr': float(s.get('delta_cvr', 0) or 0),
-                    'prev_purchases': int(s.get('prev_purchases', 0) or 0),
-                }
-                sku_list.append(sku_data)
-            product['skus'] = sku_list
-        else:
-            product['skus'] = []
-        
-        result.append(product)
+        # このproduct_class_idに属する全SKU（購入数の多い順、デルタ情報も含む）
+        product['skus'] = sku_cache.get(product['product_class_id'], [])
     
     return result
 
 
+def build_sku_lists(df, class_ids, sku_cache):
+    """指定した商品ごとのSKU詳細リストを作成してsku_cacheに入れる"""
+    # 対象商品のSKU行・使うカラムだけに絞ってから、CVRなどを列単位でまとめて用意する
+    df = df.loc[df['product_class_id'].isin(class_ids),
+                [col for col in PV_RANKING_COLS if col in df.columns]]
+    sku_table = build_sku_table(df)
+    # 全SKUの購入数順（同数は元の並び）を1回だけ求めておくと、
+    # その順序で引いた各商品のSKU行はそのまま購入数順になる
+    sku_order = np.argsort(-sku_table['purchases'].to_numpy(), kind='stable')
+    sorted_class_ids = pd.Series(df['product_class_id'].to_numpy()[sku_order])
+    sku_positions = sorted_class_ids.groupby(sorted_class_ids, sort=False).indices
+    # SKU辞書は列ごとのNumPy配列から組み立てる（行ごとのSeries生成を避ける）
+    sku_names = [col for col, _, _ in SKU_DETAIL_FIELDS]
+    sku_columns = [sku_table[col].to_numpy() for col in sku_names]
+    
+    for pcid, positions in sku_positions.items():
+        rows = sku_order[positions]
+        sku_cache[pcid] = [
+            dict(zip(sku_names, values))
+            for values in zip(*[col[rows].tolist() for col in sku_columns])
+        ]
+
+
 def get_pv_ranking_by_brand(limit_per_brand=30):
-    """ブランド別PVランキングを取得"""
+    """ブランド別PVランキングを取得（全ブランドを1回の集計で処理、返り値は書き換えないこと）"""
     df = data_store['merged_data']
     if df is None:
         return {}
     
-    brands = df['brand'].dropna().unique().tolist()
-    result = {}
+    cache = get_pv_ranking_cache(df)
+    key = ('by_brand', limit_per_brand)
+    result = cache['results'].get(key)
+    if result is not None:
+        return result
+    
+    brands = get_precomputed()['brands']
+    result = {brand: [] for brand in brands}
     
-    for brand in brands:
-        result[brand] = get_pv_ranking(brand=brand, limit=limit_per_brand)
+    if 'product_class_id' in df.columns:
+        # PV順に並んだ全商品からブランドごとに上位を取り、SKU詳細はまとめて付ける
+        grouped = aggregate_pv_products(df).sort_values('views', ascending=False, kind='stable')
+        grouped = grouped.groupby('brand', sort=False, observed=True).head(limit_per_brand)
+        for product in attach_pv_skus(df, grouped, cache['skus']):
+            result.setdefault(product['brand'], []).append(product)
     
+    if len(cache['results']) < PV_RANKING_CACHE_SIZE:
+        cache['results'][key] = result
     return result
 
 
@@ -1201,7 +1847,7 @@ def get_grouped_products(df, sort_by='views', limit=50):
         return []
     
     # product_class_idでグループ化して集計
-    grouped = df.groupby('product_class_id').agg({
+    grouped = df.groupby('product_class_id', observed=True).agg({
         'sku_id': 'count',  # SKU数
         'brand': 'first',
         'product_name': 'first',
@@ -1219,21 +1865,23 @@ def get_grouped_products(df, sort_by='views', limit=50):
                        'add_to_cart', 'purchases', 'revenue']
     
     # CVR計算
-    grouped['cvr'] = grouped.apply(
-        lambda x: (x['purchases'] / x['views'] * 100) if x['views'] > 0 else 0, axis=1
-    )
+    grouped['cvr'] = safe_divide(grouped['purchases'], grouped['views'], 100)
+    
+    # 上位を取得（全件ソートせずnlargestで取る）
+    grouped = grouped.nlargest(limit, sort_by)
     
-    # ソートして上位を取得
-    grouped = grouped.sort_values(sort_by, ascending=False).head(limit)
+    # 上位商品のSKU行だけに絞ってsort_by順に並べ、product_class_idごとの行位置を1回で引けるようにする
+    top_skus = df[df['product_class_id'].isin(grouped['product_class_id'])]
+    top_skus = top_skus.iloc[np.argsort(-top_skus[sort_by].to_numpy(), kind='stable')]
+    sku_positions = top_skus.groupby('product_class_id', sort=False, observed=True).indices
     
-    # 各グループのSKU詳細を取得
-    result = []
-    for _, row in grouped.iterrows():
-        product = row.to_dict()
+    # 各グループのSKU詳細を取得（SKU行は1回だけdict化して位置で振り分ける）
+    sku_records = frame_to_records(top_skus)
+    result = frame_to_records(grouped)
+    for product in result:
         # このproduct_class_idに属するSKUを取得
-        skus = df[df['product_class_id'] == row['product_class_id']].sort_values(sort_by, ascending=False)
-        product['skus'] = skus.to_dict('records')
-        result.append(product)
+        positions = sku_positions.get(product['product_class_id'], [])
+        product['skus'] = [sku_records[i] for i in positions]
     
     return result
 
@@ -1244,14 +1892,13 @@ def get_top_performers_grouped(brand=None, limit=20):
     if df is None:
         return []
     
-    filtered = df.copy()
-    if brand and brand != 'all':
-        filtered = filtered[filtered['brand'] == brand]
+    # 集計・並べ替えは新しいDataFrameを返すのでコピーしない
+    filtered = filter_brand(df, brand)
     
     if 'product_class_id' in filtered.columns:
         return get_grouped_products(filtered, 'revenue', limit)
     
-    filtered = filtered.sort_values('revenue', ascending=False).head(limit)
+    filtered = filtered.nlargest(limit, 'revenue')
     return filtered.to_dict('records')
 
 
@@ -1266,6 +1913,8 @@ def login():
             session['logged_in'] = True
             session['is_admin'] = result['is_admin']
             session['accessible_brands'] = result['brands']
+            session['sid'] = secrets.token_hex(16)
+            get_session_auth()
             
             if result['is_admin']:
                 flash('管理者としてログインしました', 'success')
@@ -1282,6 +1931,7 @@ def login():
 @app.route('/logout')
 def logout():
     """ログアウト"""
+    auth_cache.pop(session.pop('sid', None), None)
     session.pop('logged_in', None)
     session.pop('is_admin', None)
     session.pop('accessible_brands', None)
@@ -1298,33 +1948,30 @@ def index():
     pv_ranking_by_brand = {}
     analysis_period = None
     
-    # アクセス可能なブランドを取得
-    accessible_brands = session.get('accessible_brands', BRANDS)
-    is_admin = session.get('is_admin', False)
+    # アクセス可能なブランドを取得（小文字化済みのセット）
+    auth = get_session_auth()
+    allowed = auth['accessible_set']
+    is_admin = auth['is_admin']
     
     if has_data:
-        all_brands = data_store['merged_data']['brand'].dropna().unique().tolist()
+        all_brands = get_precomputed()['brands']
         
         # アクセス可能なブランドのみフィルタ
         if is_admin:
             brands = all_brands
         else:
-            brands = [b for b in all_brands if any(
-                b.lower() == ab.lower() for ab in accessible_brands
-            )]
+            brands = [b for b in all_brands if b.lower() in allowed]
         
-        summary = get_brand_summary()
+        dashboard = get_dashboard_data()
+        summary = dashboard['summary']
         # サマリーもフィルタ
         if summary and not is_admin:
-            summary = [s for s in summary if any(
-                s['brand'].lower() == ab.lower() for ab in accessible_brands
-            )]
+            summary = [s for s in summary if s['brand'].lower() in allowed]
         
-        pv_ranking_by_brand = get_pv_ranking_by_brand(limit_per_brand=30)
+        pv_ranking_by_brand = dashboard['pv_ranking_by_brand']
         # PVランキングもフィルタ
         if not is_admin:
-            pv_ranking_by_brand = {k: v for k, v in pv_ranking_by_brand.items() 
-                                   if any(k.lower() == ab.lower() for ab in accessible_brands)}
+            pv_ranking_by_brand = {k: v for k, v in pv_ranking_by_brand.items() if k.lower() in allowed}
         
         analysis_period = get_analysis_period()
     
@@ -1386,9 +2033,12 @@ def upload():
                 file.save(filepath)
                 try:
                     data_store['product_master'] = load_product_master(filepath)
+                    invalidate_merge_cache()
                     # R2にもアップロード（設定されている場合）
                     if is_r2_enabled():
-                        upload_product_master(filepath)
+                        if upload_product_master(filepath):
+                            # 次回起動時にR2から再ダウンロード・再解析しないようスナップショットを保存
+                            save_product_master_snapshot(data_store['product_master'], get_product_master_info())
                         flash(f'商品マスタを読み込み＆R2に保存しました（{len(data_store["product_master"])}件）', 'success')
                     else:
                         flash(f'商品マスタを読み込みました（{len(data_store["product_master"])}件）', 'success')
@@ -1406,7 +2056,8 @@ def upload():
                     file.save(filepath)
                     try:
                         ga_result = load_ga_sales(filepath)
-                        data_store['ga_sales'][brand] = ga_result
+                        with store_lock:
+                            data_store['ga_sales'] = {**data_store['ga_sales'], brand: ga_result}
                         period = ga_result['period']
                         period_str = ""
                         if period['start_date'] and period['end_date']:
@@ -1457,9 +2108,11 @@ def sync_r2():
         return redirect(url_for('upload'))
     
     try:
-        df = download_product_master()
-        if df is not None:
-            data_store['product_master'] = process_product_master_df(df)
+        pm, info = load_product_master_from_r2()
+        if pm is not None:
+            data_store['product_master'] = pm
+            data_store['product_master_info'] = info
+            invalidate_merge_cache()
             flash(f'R2から商品マスタを同期しました（{len(data_store["product_master"])}件）', 'success')
             
             # GAデータがあれば再分析
@@ -1491,108 +2144,121 @@ def fetch_ga4():
             flash('GA4からデータを取得できませんでした', 'error')
             return redirect(url_for('upload'))
         
-        # 古いデータをクリアして、新しいデータのみを使用
-        data_store['ga_sales'] = {}
-        data_store['ga_sales_previous'] = {}
-        
-        # 取得したデータをdata_storeに保存 & R2にも保存
-        for brand, result in results.items():
-            data_store['ga_sales'][brand] = result
-            period = result['period']
-            period_str = f"（{period['start_date'].strftime('%m/%d')}〜{period['end_date'].strftime('%m/%d')}）"
-            flash(f'{brand.upper()} GA4データを取得しました（{len(result["data"])}件）{period_str}', 'success')
-            
-            # R2に保存
-            if save_ga4_data and is_r2_enabled():
-                start_str = period['start_date'].strftime('%Y%m%d')
-                end_str = period['end_date'].strftime('%Y%m%d')
-                save_ga4_data(brand, result['data'], start_str, end_str)
+        # 新しいデータのみを使用（取得中の途中状態を見せないよう、ローカルで組み立ててから差し替える）
+        ga_sales = {}
+        ga_sales_previous = {}
         
-        # 前期間データも取得（比較用）
-        from ga4_api import fetch_day_before_yesterday_data, fetch_previous_3days_data, fetch_previous_weekly_data, fetch_all_brands_channel_data
+        from ga4_api import PREVIOUS_PERIOD_FETCHERS, fetch_all_brands_channel_data, fetch_all_brands_campaign_data
+        prev_fetcher = PREVIOUS_PERIOD_FETCHERS.get(period_type)
         
-        for brand in results.keys():
-            prev_result = None
-            if period_type == 'yesterday':
-                prev_result = fetch_day_before_yesterday_data(brand)
-            elif period_type == '3days':
-                prev_result = fetch_previous_3days_data(brand)
-            elif period_type == 'weekly':
-                prev_result = fetch_previous_weekly_data(brand)
+        # 当期データのR2保存と、前期間・チャネル・キャンペーンのGA4取得は互いに独立なので同時に進める
+        with ThreadPoolExecutor(max_workers=R2_IO_WORKERS) as executor:
+            prev_futures = {brand: executor.submit(prev_fetcher, brand) for brand in results} if prev_fetcher else {}
+            channel_future = executor.submit(fetch_all_brands_channel_data, period_type)
+            campaign_future = executor.submit(fetch_all_brands_campaign_data, period_type)
             
-            if prev_result:
-                data_store['ga_sales_previous'][brand] = prev_result
-                prev_period = prev_result['period']
-                print(f"[OK] Fetched previous period data for {brand}: {len(prev_result['data'])} items")
-        
-        # チャネルデータも取得
-        try:
-            channel_results = fetch_all_brands_channel_data(period_type)
-            for brand, channel_df in channel_results.items():
-                data_store['channel_data'][brand] = channel_df
-                print(f"[OK] Fetched channel data for {brand}: {len(channel_df) if channel_df is not None else 0} channels")
-        except Exception as e:
-            print(f"[WARN] Failed to fetch channel data: {e}")
+            # 取得したデータを保存 & R2にも保存
+            save_futures = []
+            for brand, result in results.items():
+                ga_sales[brand] = result
+                period = result['period']
+                period_str = f"（{period['start_date'].strftime('%m/%d')}〜{period['end_date'].strftime('%m/%d')}）"
+                flash(f'{brand.upper()} GA4データを取得しました（{len(result["data"])}件）{period_str}', 'success')
+                
+                # R2に保存
+                if is_r2_enabled():
+                    start_str = period['start_date'].strftime('%Y%m%d')
+                    end_str = period['end_date'].strftime('%Y%m%d')
+                    save_futures.append(executor.submit(save_ga4_data, brand, result['data'], start_str, end_str))
+            
+            # 前期間データも取得（比較用）
+            for brand, prev_future in prev_futures.items():
+                prev_result = prev_future.result()
+                if prev_result:
+                    ga_sales_previous[brand] = prev_result
+                    print(f"[OK] Fetched previous period data for {brand}: {len(prev_result['data'])} items")
+            
+            # チャネルデータも取得（反映はGAデータと一緒にロック内で行う）
+            channel_updates = {}
+            try:
+                for brand, channel_df in channel_future.result().items():
+                    channel_updates[brand] = channel_df
+                    print(f"[OK] Fetched channel data for {brand}: {len(channel_df) if channel_df is not None else 0} channels")
+            except Exception as e:
+                print(f"[WARN] Failed to fetch channel data: {e}")
+            
+            # キャンペーンデータも取得
+            campaign_updates = {}
+            try:
+                for brand, campaign_info in campaign_future.result().items():
+                    campaign_updates[brand] = campaign_info
+                    print(f"[OK] Fetched campaign data for {brand}")
+            except Exception as e:
+                print(f"[WARN] Failed to fetch campaign data: {e}")
+            
+            for save_future in save_futures:
+                save_future.result()
         
-        # キャンペーンデータも取得
-        try:
-            from ga4_api import fetch_all_brands_campaign_data
-            campaign_results = fetch_all_brands_campaign_data(period_type)
-            for brand, campaign_info in campaign_results.items():
-                data_store['campaign_data'][brand] = campaign_info
-                print(f"[OK] Fetched campaign data for {brand}")
-        except Exception as e:
-            print(f"[WARN] Failed to fetch campaign data: {e}")
+        # 取得したGA・チャネル・キャンペーンデータをまとめて差し替え、商品マスタがあれば分析実行（期間切替・定期更新と排他）
+        with store_lock:
+            data_store['ga_sales'] = ga_sales
+            data_store['ga_sales_previous'] = ga_sales_previous
+            channel_data = {**data_store['channel_data'], **channel_updates}
+            campaign_data = {**data_store['campaign_data'], **campaign_updates}
+            data_store['channel_data'] = channel_data
+            data_store['campaign_data'] = campaign_data
+            
+            if data_store['product_master'] is not None:
+                merge_and_analyze()
+                
+                # 期間別データにも保存（期間切り替え用）
+                data_store['periods_data'][period_type]['ga_sales'] = data_store['ga_sales']
+                data_store['periods_data'][period_type]['ga_sales_previous'] = data_store['ga_sales_previous']
+                data_store['periods_data'][period_type]['channel_data'] = data_store['channel_data']
+                data_store['periods_data'][period_type]['campaign_data'] = data_store['campaign_data']
+                data_store['periods_data'][period_type]['merged_data'] = data_store['merged_data']
+                data_store['periods_data'][period_type]['merged_data_previous'] = data_store['merged_data_previous']
+                data_store['current_period'] = period_type
         
-        # 商品マスタがあれば分析実行
         if data_store['product_master'] is not None:
-            merge_and_analyze()
-            
-            # 期間別データにも保存（期間切り替え用）
-            data_store['periods_data'][period_type]['ga_sales'] = data_store['ga_sales'].copy()
-            data_store['periods_data'][period_type]['ga_sales_previous'] = data_store['ga_sales_previous'].copy()
-            data_store['periods_data'][period_type]['channel_data'] = data_store['channel_data'].copy()
-            data_store['periods_data'][period_type]['campaign_data'] = data_store['campaign_data'].copy()
-            data_store['periods_data'][period_type]['merged_data'] = data_store['merged_data']
-            data_store['periods_data'][period_type]['merged_data_previous'] = data_store['merged_data_previous']
-            data_store['current_period'] = period_type
-            
             # R2に期間別データを保存（永続化）
-            if save_period_data and is_r2_enabled():
-                for brand, ga_info in data_store['ga_sales'].items():
+            if is_r2_enabled():
+                # 保存は1件ずつ独立したPUTなので、まとめて並列に送る
+                save_calls = {}
+                for brand, ga_info in ga_sales.items():
                     if ga_info and 'data' in ga_info and 'period' in ga_info:
                         period = ga_info['period']
                         start_str = period['start_date'].strftime('%Y%m%d') if period['start_date'] else ''
                         end_str = period['end_date'].strftime('%Y%m%d') if period['end_date'] else ''
-                        save_period_data(period_type, brand, ga_info['data'], start_str, end_str, is_previous=False)
+                        save_calls[('period', brand, False)] = (save_period_data, period_type, brand, ga_info['data'], start_str, end_str, False)
                 
-                for brand, ga_info in data_store['ga_sales_previous'].items():
+                for brand, ga_info in ga_sales_previous.items():
                     if ga_info and 'data' in ga_info and 'period' in ga_info:
                         period = ga_info['period']
                         start_str = period['start_date'].strftime('%Y%m%d') if period['start_date'] else ''
                         end_str = period['end_date'].strftime('%Y%m%d') if period['end_date'] else ''
-                        save_period_data(period_type, brand, ga_info['data'], start_str, end_str, is_previous=True)
+                        save_calls[('period', brand, True)] = (save_period_data, period_type, brand, ga_info['data'], start_str, end_str, True)
                 
                 # チャネルデータもR2に保存
-                if save_channel_data:
-                    for brand, channel_info in data_store['channel_data'].items():
-                        if channel_info and 'current' in channel_info and channel_info['current'] is not None:
-                            period_info = channel_info.get('period', {})
-                            start_str = period_info.get('start', '')
-                            end_str = period_info.get('end', '')
-                            save_channel_data(period_type, brand, channel_info['current'], start_str, end_str, is_previous=False)
-                            if channel_info.get('previous') is not None:
-                                prev_start = period_info.get('prev_start', '')
-                                prev_end = period_info.get('prev_end', '')
-                                save_channel_data(period_type, brand, channel_info['previous'], prev_start, prev_end, is_previous=True)
+                for brand, channel_info in channel_data.items():
+                    if channel_info and 'current' in channel_info and channel_info['current'] is not None:
+                        period_info = channel_info.get('period', {})
+                        start_str = period_info.get('start', '')
+                        end_str = period_info.get('end', '')
+                        save_calls[('channel', brand, False)] = (save_channel_data, period_type, brand, channel_info['current'], start_str, end_str, False)
+                        if channel_info.get('previous') is not None:
+                            prev_start = period_info.get('prev_start', '')
+                            prev_end = period_info.get('prev_end', '')
+                            save_calls[('channel', brand, True)] = (save_channel_data, period_type, brand, channel_info['previous'], prev_start, prev_end, True)
                 
                 # キャンペーンデータもR2に保存
-                if save_campaign_data:
-                    for brand, campaign_info in data_store['campaign_data'].items():
-                        if campaign_info and 'current' in campaign_info and campaign_info['current'] is not None:
-                            save_campaign_data(period_type, brand, campaign_info['current'], '', '', is_previous=False)
-                            if campaign_info.get('previous') is not None:
-                                save_campaign_data(period_type, brand, campaign_info['previous'], '', '', is_previous=True)
+                for brand, campaign_info in campaign_data.items():
+                    if campaign_info and 'current' in campaign_info and campaign_info['current'] is not None:
+                        save_calls[('campaign', brand, False)] = (save_campaign_data, period_type, brand, campaign_info['current'], '', '', False)
+                        if campaign_info.get('previous') is not None:
+                            save_calls[('campaign', brand, True)] = (save_campaign_data, period_type, brand, campaign_info['previous'], '', '', True)
+                
+                run_r2_parallel(save_calls)
             
             flash('データの突合・分析が完了しました！', 'success')
             return redirect(url_for('index'))
@@ -1629,8 +2295,7 @@ def scheduled_update():
     
     try:
         from ga4_api import (
-            fetch_all_brands_data, fetch_day_before_yesterday_data,
-            fetch_previous_3days_data, fetch_previous_weekly_data,
+            fetch_all_brands_data, PREVIOUS_PERIOD_FETCHERS,
             fetch_all_brands_channel_data
         )
         
@@ -1651,6 +2316,11 @@ def scheduled_update():
                     continue
                 
                 # データを期間別ストアに保存
+                # メインストアと参照を共有している場合があるので、dictを作り直してから書き込む
+                period_store = data_store['periods_data'][period_type]
+                for key in ('ga_sales', 'ga_sales_previous', 'channel_data'):
+                    period_store[key] = dict(period_store[key])
+                
                 for brand, result in results.items():
                     data_store['periods_data'][period_type]['ga_sales'][brand] = result
                     period = result['period']
@@ -1662,42 +2332,42 @@ def scheduled_update():
                     }
                     print(f"[SCHEDULER] {period_type}/{brand}: {len(result['data'])} items")
                 
-                # 前期間データも取得（比較用）
-                for brand in results.keys():
-                    prev_result = None
-                    if period_type == 'yesterday':
-                        prev_result = fetch_day_before_yesterday_data(brand)
-                    elif period_type == '3days':
-                        prev_result = fetch_previous_3days_data(brand)
-                    elif period_type == 'weekly':
-                        prev_result = fetch_previous_weekly_data(brand)
+                # 前期間データ（比較用）とチャネルデータはブランドをまたいで同時に取得
+                prev_fetcher = PREVIOUS_PERIOD_FETCHERS.get(period_type)
+                with ThreadPoolExecutor(max_workers=R2_IO_WORKERS) as executor:
+                    prev_futures = {brand: executor.submit(prev_fetcher, brand) for brand in results} if prev_fetcher else {}
+                    channel_future = executor.submit(fetch_all_brands_channel_data, period_type)
                     
-                    if prev_result:
-                        data_store['periods_data'][period_type]['ga_sales_previous'][brand] = prev_result
-                
-                # チャネルデータも取得
-                try:
-                    channel_results = fetch_all_brands_channel_data(period_type)
-                    for brand, channel_df in channel_results.items():
-                        data_store['periods_data'][period_type]['channel_data'][brand] = channel_df
-                except Exception as e:
-                    print(f"[SCHEDULER] Channel data error for {period_type}: {e}")
+                    for brand, prev_future in prev_futures.items():
+                        prev_result = prev_future.result()
+                        if prev_result:
+                            data_store['periods_data'][period_type]['ga_sales_previous'][brand] = prev_result
+                    
+                    # チャネルデータも取得
+                    try:
+                        channel_results = channel_future.result()
+                        for brand, channel_df in channel_results.items():
+                            data_store['periods_data'][period_type]['channel_data'][brand] = channel_df
+                    except Exception as e:
+                        print(f"[SCHEDULER] Channel data error for {period_type}: {e}")
                 
                 # R2に期間別データを保存（永続化）
-                if save_period_data and is_r2_enabled():
+                if is_r2_enabled():
+                    save_calls = {}
                     for brand, ga_info in data_store['periods_data'][period_type]['ga_sales'].items():
                         if ga_info and 'data' in ga_info and 'period' in ga_info:
                             period = ga_info['period']
                             start_str = period['start_date'].strftime('%Y%m%d') if period['start_date'] else ''
                             end_str = period['end_date'].strftime('%Y%m%d') if period['end_date'] else ''
-                            save_period_data(period_type, brand, ga_info['data'], start_str, end_str, is_previous=False)
+                            save_calls[(brand, False)] = (save_period_data, period_type, brand, ga_info['data'], start_str, end_str, False)
                     
                     for brand, ga_info in data_store['periods_data'][period_type]['ga_sales_previous'].items():
                         if ga_info and 'data' in ga_info and 'period' in ga_info:
                             period = ga_info['period']
                             start_str = period['start_date'].strftime('%Y%m%d') if period['start_date'] else ''
                             end_str = period['end_date'].strftime('%Y%m%d') if period['end_date'] else ''
-                            save_period_data(period_type, brand, ga_info['data'], start_str, end_str, is_previous=True)
+                            save_calls[(brand, True)] = (save_period_data, period_type, brand, ga_info['data'], start_str, end_str, True)
+                    run_r2_parallel(save_calls)
                     print(f"[SCHEDULER] Saved {period_type} data to R2")
                 
             except Exception as e:
@@ -1763,35 +2433,19 @@ def brand_detail(brand_name):
         if campaign_info:
             campaign_data = process_campaign_data(campaign_info)
     
-    # ブランド統計
-    df = data_store['merged_data']
-    if brand:
-        brand_df = df[df['brand'] == brand]
-    else:
-        brand_df = df
+    # ブランド統計（マージ結果ごとに作成済み）
+    stats = get_brand_stats(brand)
     
-    stats = {
-        'total_sku': len(brand_df),
-        'total_stock': int(brand_df['total_stock'].sum()),
-        'total_revenue': float(brand_df['revenue'].sum()),
-        'total_views': int(brand_df['views'].sum()),
-        'avg_cvr': float(brand_df['cvr'].mean()),
-        'problem_count': int(brand_df['is_problem'].sum()),
-        'opportunity_count': int(brand_df['is_opportunity'].sum()),
-    }
-    
-    all_brands = df['brand'].dropna().unique().tolist()
+    all_brands = get_precomputed()['brands']
     analysis_period = get_analysis_period()
     
     # アクセス可能なブランドのみ表示
-    is_admin = session.get('is_admin', False)
-    accessible_brands = session.get('accessible_brands', BRANDS)
+    auth = get_session_auth()
+    is_admin = auth['is_admin']
     if is_admin:
         brands = all_brands
     else:
-        brands = [b for b in all_brands if any(
-            b.lower() == ab.lower() for ab in accessible_brands
-        )]
+        brands = [b for b in all_brands if b.lower() in auth['accessible_set']]
     
     return render_template('brand_detail.html',
                          brand_name=brand_name,
@@ -1810,13 +2464,38 @@ def brand_detail(brand_name):
 
 @app.route('/api/products')
 def api_products():
-    """商品データAPI"""
+    """商品データAPI（データが変わるまで同じETagを返し、If-None-Matchが一致すれば304で返す）"""
     if data_store['merged_data'] is None:
         return jsonify([])
     
-    brand = request.args.get('brand', 'all')
-    category = request.args.get('category', 'all')  # problem, opportunity, top, pv
-    limit = int(request.args.get('limit', 50))
+    # ETagはプロセス・マージ結果の世代・クエリ文字列から作る（同じデータ・同じ条件なら同じレスポンス）
+    # 世代番号はプロセスごとなので、別ワーカーのETagとは一致させない
+    query_hash = hashlib.blake2b(request.query_string, digest_size=8).hexdigest()
+    etag = f"{os.getpid()}-{get_precomputed()['version']}-{query_hash}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        brand = request.args.get('brand', 'all')
+        category = request.args.get('category', 'all')  # problem, opportunity, top, pv
+        limit = int(request.args.get('limit', 50))
+        response = build_products_response(brand, category, limit, request.args.get('format'))
+    
+    response.set_etag(etag)
+    # キャッシュは使ってよいが、毎回ETagで再検証させる
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def build_products_response(brand, category, limit, fmt=None):
+    """商品データAPIのレスポンスを作成"""
+    # format=columns: 列指向JSONで返す（列名を行ごとに繰り返さないのでペイロードも小さい）
+    if fmt == 'columns':
+        if category == 'pv':
+            # PVランキングはキャッシュ済みの結果を列指向にし、SKU一覧も商品ごとに列指向にする
+            return jsonify(records_to_columns(get_pv_ranking(brand, limit), nested_key='skus'))
+        slice_names = {'problem': 'problem_sorted', 'opportunity': 'opportunity_sorted'}
+        df = get_ranked_slice(slice_names.get(category, 'top_sorted'), brand, limit)
+        return Response(df_to_json_bytes(df), mimetype='application/json')
     
     if category == 'problem':
         products = get_problem_products(brand, limit)
@@ -1864,6 +2543,19 @@ def admin_passwords():
                          password_cache=password_cache)
 
 
+# R2の読み書きやGA4の取得を並列に行うときの最大スレッド数（ネットワーク待ちが中心なのでCPU数より多くてよい）
+R2_IO_WORKERS = 8
+
+
+def run_r2_parallel(calls):
+    """R2への読み書きをスレッドで並列実行し、キーごとの結果を返す（calls: {キー: (関数, 引数...)}、例外はそのまま送出）"""
+    if not calls:
+        return {}
+    with ThreadPoolExecutor(max_workers=R2_IO_WORKERS) as executor:
+        futures = {key: executor.submit(func, *args) for key, (func, *args) in calls.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
 def init_from_r2():
     """起動時にR2から最新の商品マスタと期間別データを読み込む"""
     if not is_r2_enabled():
@@ -1872,124 +2564,136 @@ def init_from_r2():
     
     try:
         print("[INFO] Loading product master from R2...")
-        df = download_product_master()
-        if df is not None and len(df) > 0:
-            data_store['product_master'] = process_product_master_df(df)
-            data_store['product_master_info'] = get_product_master_info()
+        pm, info = load_product_master_from_r2()
+        if pm is not None:
+            data_store['product_master'] = pm
+            data_store['product_master_info'] = info
             print(f"[OK] Loaded {len(data_store['product_master'])} products from R2")
             
             # 期間別データを読み込み（新方式）
-            if load_period_data and get_available_periods:
-                print("[INFO] Loading period data from R2...")
-                available = get_available_periods()
-                print(f"[INFO] Available periods in R2: {available}")
+            print("[INFO] Loading period data from R2...")
+            available = get_available_periods()
+            print(f"[INFO] Available periods in R2: {available}")
+            
+            period_types = ['yesterday', '3days', 'weekly']
+            # 期間×ブランドのGAデータ（今期・前期）をまとめて並列に読み込む
+            ga_results = run_r2_parallel({
+                (period_type, brand, is_previous): (load_period_data, period_type, brand, is_previous)
+                for period_type in period_types for brand in BRANDS for is_previous in (False, True)
+            })
+            
+            loaded_periods = []
+            for period_type in period_types:
+                period_ga_sales = {}
+                period_ga_sales_prev = {}
+                has_data = False
                 
-                loaded_periods = []
-                for period_type in ['yesterday', '3days', 'weekly']:
-                    period_ga_sales = {}
-                    period_ga_sales_prev = {}
-                    has_data = False
+                for brand in BRANDS:
+                    # 現在期間データ
+                    data = ga_results[(period_type, brand, False)]
+                    if data:
+                        start_date = datetime.strptime(data['start_date'], '%Y%m%d') if data.get('start_date') else None
+                        end_date = datetime.strptime(data['end_date'], '%Y%m%d') if data.get('end_date') else None
+                        period_ga_sales[brand] = {
+                            'data': data['df'],
+                            'period': {
+                                'start_date': start_date,
+                                'end_date': end_date,
+                                'period_type': period_type
+                            }
+                        }
+                        has_data = True
                     
-                    for brand in BRANDS:
-                        # 現在期間データ
-                        data = load_period_data(period_type, brand, is_previous=False)
-                        if data:
-                            from datetime import datetime
-                            start_date = datetime.strptime(data['start_date'], '%Y%m%d') if data.get('start_date') else None
-                            end_date = datetime.strptime(data['end_date'], '%Y%m%d') if data.get('end_date') else None
-                            period_ga_sales[brand] = {
-                                'data': data['df'],
-                                'period': {
-                                    'start_date': start_date,
-                                    'end_date': end_date,
-                                    'period_type': period_type
-                                }
+                    # 前期間データ
+                    prev_data = ga_results[(period_type, brand, True)]
+                    if prev_data:
+                        start_date = datetime.strptime(prev_data['start_date'], '%Y%m%d') if prev_data.get('start_date') else None
+                        end_date = datetime.strptime(prev_data['end_date'], '%Y%m%d') if prev_data.get('end_date') else None
+                        period_ga_sales_prev[brand] = {
+                            'data': prev_data['df'],
+                            'period': {
+                                'start_date': start_date,
+                                'end_date': end_date,
+                                'period_type': period_type
                             }
-                            has_data = True
-                        
-                        # 前期間データ
-                        prev_data = load_period_data(period_type, brand, is_previous=True)
-                        if prev_data:
-                            from datetime import datetime
-                            start_date = datetime.strptime(prev_data['start_date'], '%Y%m%d') if prev_data.get('start_date') else None
-                            end_date = datetime.strptime(prev_data['end_date'], '%Y%m%d') if prev_data.get('end_date') else None
-                            period_ga_sales_prev[brand] = {
-                                'data': prev_data['df'],
-                                'period': {
-                                    'start_date': start_date,
-                                    'end_date': end_date,
-                                    'period_type': period_type
-                                }
+                        }
+                
+                if has_data:
+                    data_store['periods_data'][period_type]['ga_sales'] = period_ga_sales
+                    data_store['periods_data'][period_type]['ga_sales_previous'] = period_ga_sales_prev
+                    loaded_periods.append(period_type)
+                    print(f"  [OK] Loaded {period_type}: {len(period_ga_sales)} brands")
+            
+            # データのあった期間のチャネル・キャンペーンデータもまとめて並列に読み込む
+            extra_calls = {}
+            for period_type in loaded_periods:
+                for brand in BRANDS:
+                    for is_previous in (False, True):
+                        extra_calls[('channel', period_type, brand, is_previous)] = (load_channel_data, period_type, brand, is_previous)
+                        extra_calls[('campaign', period_type, brand, is_previous)] = (load_campaign_data, period_type, brand, is_previous)
+            extra_results = run_r2_parallel(extra_calls)
+            
+            for period_type in loaded_periods:
+                # チャネルデータもR2から読み込み
+                period_channel_data = {}
+                for brand in BRANDS:
+                    ch_data = extra_results[('channel', period_type, brand, False)]
+                    ch_prev = extra_results[('channel', period_type, brand, True)]
+                    if ch_data:
+                        period_channel_data[brand] = {
+                            'current': ch_data['df'],
+                            'previous': ch_prev['df'] if ch_prev else None,
+                            'period': {
+                                'start': ch_data.get('start_date', ''),
+                                'end': ch_data.get('end_date', ''),
                             }
-                    
-                    if has_data:
-                        data_store['periods_data'][period_type]['ga_sales'] = period_ga_sales
-                        data_store['periods_data'][period_type]['ga_sales_previous'] = period_ga_sales_prev
-                        loaded_periods.append(period_type)
-                        print(f"  [OK] Loaded {period_type}: {len(period_ga_sales)} brands")
-                        
-                        # チャネルデータもR2から読み込み
-                        if load_channel_data:
-                            period_channel_data = {}
-                            for brand in BRANDS:
-                                ch_data = load_channel_data(period_type, brand, is_previous=False)
-                                ch_prev = load_channel_data(period_type, brand, is_previous=True)
-                                if ch_data:
-                                    period_channel_data[brand] = {
-                                        'current': ch_data['df'],
-                                        'previous': ch_prev['df'] if ch_prev else None,
-                                        'period': {
-                                            'start': ch_data.get('start_date', ''),
-                                            'end': ch_data.get('end_date', ''),
-                                        }
-                                    }
-                            if period_channel_data:
-                                data_store['periods_data'][period_type]['channel_data'] = period_channel_data
-                                print(f"    [OK] Loaded channel data for {period_type}: {len(period_channel_data)} brands")
-                        
-                        # キャンペーンデータもR2から読み込み
-                        if load_campaign_data:
-                            period_campaign_data = {}
-                            for brand in BRANDS:
-                                camp_data = load_campaign_data(period_type, brand, is_previous=False)
-                                camp_prev = load_campaign_data(period_type, brand, is_previous=True)
-                                if camp_data:
-                                    period_campaign_data[brand] = {
-                                        'current': camp_data['df'],
-                                        'previous': camp_prev['df'] if camp_prev else None,
-                                    }
-                            if period_campaign_data:
-                                data_store['periods_data'][period_type]['campaign_data'] = period_campaign_data
-                                print(f"    [OK] Loaded campaign data for {period_type}: {len(period_campaign_data)} brands")
+                        }
+                if period_channel_data:
+                    data_store['periods_data'][period_type]['channel_data'] = period_channel_data
+                    print(f"    [OK] Loaded channel data for {period_type}: {len(period_channel_data)} brands")
                 
-                # 読み込んだ期間全てに対して分析を実行
-                if loaded_periods:
-                    for period_type in loaded_periods:
-                        # 期間データをメインストアにセット
-                        data_store['ga_sales'] = data_store['periods_data'][period_type]['ga_sales'].copy()
-                        data_store['ga_sales_previous'] = data_store['periods_data'][period_type]['ga_sales_previous'].copy()
-                        data_store['current_period'] = period_type
-                        
-                        # 分析実行
-                        merge_and_analyze()
-                        
-                        # 分析結果を期間データに保存
-                        data_store['periods_data'][period_type]['merged_data'] = data_store['merged_data']
-                        data_store['periods_data'][period_type]['merged_data_previous'] = data_store['merged_data_previous']
-                        print(f"  [OK] Analyzed {period_type}")
+                # キャンペーンデータもR2から読み込み
+                period_campaign_data = {}
+                for brand in BRANDS:
+                    camp_data = extra_results[('campaign', period_type, brand, False)]
+                    camp_prev = extra_results[('campaign', period_type, brand, True)]
+                    if camp_data:
+                        period_campaign_data[brand] = {
+                            'current': camp_data['df'],
+                            'previous': camp_prev['df'] if camp_prev else None,
+                        }
+                if period_campaign_data:
+                    data_store['periods_data'][period_type]['campaign_data'] = period_campaign_data
+                    print(f"    [OK] Loaded campaign data for {period_type}: {len(period_campaign_data)} brands")
+            
+            # 読み込んだ期間全てに対して分析を実行
+            if loaded_periods:
+                for period_type in loaded_periods:
+                    # 期間データをメインストアにセット
+                    data_store['ga_sales'] = data_store['periods_data'][period_type]['ga_sales']
+                    data_store['ga_sales_previous'] = data_store['periods_data'][period_type]['ga_sales_previous']
+                    data_store['current_period'] = period_type
                     
-                    # 最初の期間をデフォルトにセット
-                    default_period = loaded_periods[0]
-                    switch_period_data(default_period)
-                    print(f"[OK] Initialized with {default_period} data")
+                    # 分析実行
+                    merge_and_analyze()
+                    
+                    # 分析結果を期間データに保存
+                    data_store['periods_data'][period_type]['merged_data'] = data_store['merged_data']
+                    data_store['periods_data'][period_type]['merged_data_previous'] = data_store['merged_data_previous']
+                    print(f"  [OK] Analyzed {period_type}")
+                
+                # 最初の期間をデフォルトにセット
+                default_period = loaded_periods[0]
+                switch_period_data(default_period)
+                print(f"[OK] Initialized with {default_period} data")
             
             # 旧方式のフォールバック（期間データがない場合）
-            if not loaded_periods and get_latest_ga4_data:
+            if not loaded_periods:
                 print("[INFO] Loading GA4 data from R2 (legacy)...")
+                legacy_results = run_r2_parallel({brand: (get_latest_ga4_data, brand) for brand in BRANDS})
                 for brand in BRANDS:
-                    ga4_data = get_latest_ga4_data(brand)
+                    ga4_data = legacy_results[brand]
                     if ga4_data:
-                        from datetime import datetime
                         start_date = datetime.strptime(ga4_data['start_date'], '%Y%m%d') if ga4_data['start_date'] else None
                         end_date = datetime.strptime(ga4_data['end_date'], '%Y%m%d') if ga4_data['end_date'] else None
                         data_store['ga_sales'][brand] = {
@@ -6,17 +6,23 @@ GA4 API 連携
 
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import (
-    RunReportRequest,
-    Dimension,
-    Metric,
-    DateRange,
-)
-from google.oauth2 import service_account
+import numpy as np
 import pandas as pd
 
+# Google APIクライアントは読み込みが重いので、API呼び出し時に関数内でimportする
+
+# ブランド別のGA4リクエストを同時に投げる上限（4ブランド×当期・前期）
+GA4_FETCH_WORKERS = 8
+
+# 終了日からこの日数が過ぎた期間はGA4側の集計が確定しているとみなしてレポートを使い回す
+GA4_SETTLED_DAYS = 3
+GA4_REPORT_CACHE_SIZE = 64
+ga4_report_cache = {}
+ga4_report_lock = threading.Lock()
+
 
 def get_ga4_config():
     """GA4設定を取得（呼び出し時に環境変数を読む）"""
@@ -47,25 +53,142 @@ def get_configured_brands() -> list:
     return [brand for brand, prop_id in config['properties'].items() if prop_id]
 
 
-def get_ga4_client():
-    """GA4 APIクライアントを取得"""
-    config = get_ga4_config()
+# GA4クライアントのキャッシュ（認証情報の解析とgRPCチャネル作成を毎回やらない、クライアントはスレッド間で共有できる）
+ga4_client_cache = {'key': None, 'client': None}
+ga4_client_lock = threading.Lock()
+
+
+def get_ga4_client(config: dict = None):
+    """GA4 APIクライアントを取得（呼び出し側で読んだ設定があれば渡す）"""
+    if config is None:
+        config = get_ga4_config()
     
     if not config['credentials_json']:
         print("[ERROR] GA4_CREDENTIALS_JSON not set")
         return None
     
-    try:
-        credentials_info = json.loads(config['credentials_json'])
-        credentials = service_account.Credentials.from_service_account_info(
-            credentials_info,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly']
-        )
-        client = BetaAnalyticsDataClient(credentials=credentials)
+    key = config['credentials_json']
+    # 並列取得で同時に呼ばれても作成は1回だけにする
+    with ga4_client_lock:
+        if ga4_client_cache['key'] == key:
+            return ga4_client_cache['client']
+        
+        try:
+            from google.analytics.data_v1beta import BetaAnalyticsDataClient
+            from google.oauth2 import service_account
+            
+            credentials_info = json.loads(config['credentials_json'])
+            credentials = service_account.Credentials.from_service_account_info(
+                credentials_info,
+                scopes=['https://www.googleapis.com/auth/analytics.readonly']
+            )
+            client = BetaAnalyticsDataClient(credentials=credentials)
+        except Exception as e:
+            print(f"[ERROR] Error creating GA4 client: {e}")
+            return None
+        
+        ga4_client_cache['client'] = client
+        ga4_client_cache['key'] = key
         return client
-    except Exception as e:
-        print(f"[ERROR] Error creating GA4 client: {e}")
-        return None
+
+
+def fetch_parallel(calls: dict) -> dict:
+    """{key: (func, *args)} を並列に実行して {key: 結果} を返す（例外時はNone）"""
+    if not calls:
+        return {}
+    
+    def run(call):
+        func, *args = call
+        try:
+            return func(*args)
+        except Exception as e:
+            print(f"[ERROR] GA4 fetch {func.__name__}{tuple(args)}: {e}")
+            return None
+    
+    with ThreadPoolExecutor(max_workers=min(GA4_FETCH_WORKERS, len(calls))) as executor:
+        results = executor.map(run, calls.values())
+        return dict(zip(calls.keys(), results))
+
+
+# 1リクエストで取る最大行数（GA4の既定は10,000行で、超えた分は黙って切り捨てられる）
+GA4_REPORT_PAGE_SIZE = 100000
+
+
+def run_report_all_rows(client, request):
+    """レポートを実行し、行数が上限を超える場合はoffsetでページングして全行をまとめたレスポンスを返す"""
+    request.limit = GA4_REPORT_PAGE_SIZE
+    request.offset = 0
+    response = client.run_report(request)
+    merged = type(response).pb(response)
+    while len(merged.rows) < merged.row_count:
+        request.offset = len(merged.rows)
+        page = client.run_report(request)
+        page_rows = type(page).pb(page).rows
+        if not page_rows:
+            break
+        merged.rows.extend(page_rows)
+    return response
+
+
+# レポートの列定義（ディメンション列名, {指標列名: dtype}）
+# 商品の件数はCSVアップロード時と同じint32（売上は合計精度を保つためfloat64）
+ITEM_REPORT_COLUMNS = (
+    ['sku_id', 'item_name'],
+    {'views': np.int32, 'add_to_cart': np.int32, 'purchases': np.int32, 'revenue': np.float64},
+)
+CHANNEL_REPORT_COLUMNS = (
+    ['channel', 'source'],
+    {'sessions': np.int64, 'users': np.int64, 'purchases': np.int64, 'revenue': np.float64},
+)
+CAMPAIGN_REPORT_COLUMNS = (
+    ['campaign', 'source', 'medium'],
+    {'sessions': np.int64, 'users': np.int64, 'purchases': np.int64, 'revenue': np.float64},
+)
+
+
+def report_to_frame(response, columns: tuple) -> pd.DataFrame:
+    """GA4レポートの行を列ごとのリストに集めてDataFrameにする（行ごとのdict作成と型推論をしない）"""
+    dimension_cols, metric_cols = columns
+    # proto-plusのラッパー経由だとセルごとの属性アクセスが重いので、中身のprotobufメッセージを直接読む
+    rows = type(response).pb(response).rows
+    dims = [[] for _ in dimension_cols]
+    metrics = [[] for _ in metric_cols]
+    dim_range = range(len(dims))
+    metric_range = range(len(metrics))
+    for row in rows:
+        dimension_values = row.dimension_values
+        metric_values = row.metric_values
+        for i in dim_range:
+            dims[i].append(dimension_values[i].value)
+        for i in metric_range:
+            metrics[i].append(metric_values[i].value)
+    
+    # 型は列定義で決める（0行のレスポンスでも列と型がそろったDataFrameになる）
+    data = {col: np.array(values, dtype=object) for col, values in zip(dimension_cols, dims)}
+    # 指標は文字列で返ってくるので列ごとにまとめて数値化する
+    for (col, dtype), values in zip(metric_cols.items(), metrics):
+        data[col] = np.array(values).astype(dtype)
+    return pd.DataFrame(data)
+
+
+def get_cached_report(key) -> pd.DataFrame:
+    """確定済み期間のレポートがキャッシュにあればコピーを返す"""
+    with ga4_report_lock:
+        df = ga4_report_cache.get(key)
+    return None if df is None else df.copy()
+
+
+def save_cached_report(key, df: pd.DataFrame):
+    """集計が確定した期間のレポートだけキャッシュする"""
+    end_date = key[-1]
+    settled_until = (datetime.now() - timedelta(days=GA4_SETTLED_DAYS)).strftime('%Y-%m-%d')
+    if end_date > settled_until:
+        return
+    with ga4_report_lock:
+        # 古いものから捨てる
+        if key not in ga4_report_cache and len(ga4_report_cache) >= GA4_REPORT_CACHE_SIZE:
+            ga4_report_cache.pop(next(iter(ga4_report_cache)))
+        ga4_report_cache[key] = df.copy()
 
 
 def fetch_ecommerce_data(brand: str, start_date: str, end_date: str) -> pd.DataFrame:
@@ -80,18 +203,25 @@ def fetch_ecommerce_data(brand: str, start_date: str, end_date: str) -> pd.DataF
     Returns:
         DataFrame with columns: sku_id, item_name, views, add_to_cart, purchases, revenue
     """
-    client = get_ga4_client()
+    config = get_ga4_config()
+    client = get_ga4_client(config)
     if client is None:
         return None
     
-    config = get_ga4_config()
     property_id = config['properties'].get(brand, '')
     
     if not property_id:
         print(f"[ERROR] GA4 property ID not set for brand: {brand}")
         return None
     
+    cache_key = ('items', property_id, start_date, end_date)
+    cached = get_cached_report(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
+        from google.analytics.data_v1beta.types import RunReportRequest, Dimension, Metric, DateRange
+        
         request = RunReportRequest(
             property=f"properties/{property_id}",
             dimensions=[
@@ -107,22 +237,12 @@ def fetch_ecommerce_data(brand: str, start_date: str, end_date: str) -> pd.DataF
             date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
         )
         
-        response = client.run_report(request)
+        response = run_report_all_rows(client, request)
         
         # レスポンスをDataFrameに変換
-        rows = []
-        for row in response.rows:
-            rows.append({
-                'sku_id': row.dimension_values[0].value,
-                'item_name': row.dimension_values[1].value,
-                'views': int(row.metric_values[0].value),
-                'add_to_cart': int(row.metric_values[1].value),
-                'purchases': int(row.metric_values[2].value),
-                'revenue': float(row.metric_values[3].value),
-            })
-        
-        df = pd.DataFrame(rows)
+        df = report_to_frame(response, ITEM_REPORT_COLUMNS)
         print(f"[OK] Fetched {len(df)} items from GA4 for {brand}")
+        save_cached_report(cache_key, df)
         return df
     
     except Exception as e:
@@ -130,40 +250,41 @@ def fetch_ecommerce_data(brand: str, start_date: str, end_date: str) -> pd.DataF
         return None
 
 
-def fetch_yesterday_data(brand: str) -> dict:
-    """前日のデータを取得"""
-    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    df = fetch_ecommerce_data(brand, yesterday, yesterday)
+def get_date_range(start_days_ago: int, end_days_ago: int, today: datetime = None) -> tuple:
+    """N日前〜M日前の期間を (開始日, 終了日) のdatetime（0時）で返す"""
+    if today is None:
+        today = datetime.now()
+    today = today.replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=start_days_ago), today - timedelta(days=end_days_ago)
+
+
+def fetch_period_data(brand: str, start_days_ago: int, end_days_ago: int, period_type: str) -> dict:
+    """N日前〜M日前のデータを期間情報つきで取得"""
+    # 日付は1回だけ計算する（途中で日付が変わっても開始日と終了日がずれないように）
+    start_dt, end_dt = get_date_range(start_days_ago, end_days_ago)
+    df = fetch_ecommerce_data(brand, start_dt.strftime('%Y-%m-%d'), end_dt.strftime('%Y-%m-%d'))
     
     if df is not None:
         return {
             'data': df,
             'period': {
-                'start_date': datetime.strptime(yesterday, '%Y-%m-%d'),
-                'end_date': datetime.strptime(yesterday, '%Y-%m-%d'),
-                'days': 1,
-                'period_type': 'daily'
+                'start_date': start_dt,
+                'end_date': end_dt,
+                'days': start_days_ago - end_days_ago + 1,
+                'period_type': period_type
             }
         }
     return None
 
 
+def fetch_yesterday_data(brand: str) -> dict:
+    """前日のデータを取得"""
+    return fetch_period_data(brand, 1, 1, 'daily')
+
+
 def fetch_day_before_yesterday_data(brand: str) -> dict:
     """前々日のデータを取得"""
-    day_before = (datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d')
-    df = fetch_ecommerce_data(brand, day_before, day_before)
-    
-    if df is not None:
-        return {
-            'data': df,
-            'period': {
-                'start_date': datetime.strptime(day_before, '%Y-%m-%d'),
-                'end_date': datetime.strptime(day_before, '%Y-%m-%d'),
-                'days': 1,
-                'period_type': 'daily'
-            }
-        }
-    return None
+    return fetch_period_data(brand, 2, 2, 'daily')
 
 
 def fetch_comparison_data(brand: str) -> dict:
@@ -185,78 +306,22 @@ def fetch_comparison_data(brand: str) -> dict:
 
 def fetch_3days_data(brand: str) -> dict:
     """直近3日間のデータを取得"""
-    end_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d')
-    df = fetch_ecommerce_data(brand, start_date, end_date)
-    
-    if df is not None:
-        return {
-            'data': df,
-            'period': {
-                'start_date': datetime.strptime(start_date, '%Y-%m-%d'),
-                'end_date': datetime.strptime(end_date, '%Y-%m-%d'),
-                'days': 3,
-                'period_type': '3days'
-            }
-        }
-    return None
+    return fetch_period_data(brand, 3, 1, '3days')
 
 
 def fetch_previous_3days_data(brand: str) -> dict:
     """前の3日間のデータを取得（4日前〜6日前）"""
-    end_date = (datetime.now() - timedelta(days=4)).strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=6)).strftime('%Y-%m-%d')
-    df = fetch_ecommerce_data(brand, start_date, end_date)
-    
-    if df is not None:
-        return {
-            'data': df,
-            'period': {
-                'start_date': datetime.strptime(start_date, '%Y-%m-%d'),
-                'end_date': datetime.strptime(end_date, '%Y-%m-%d'),
-                'days': 3,
-                'period_type': '3days'
-            }
-        }
-    return None
+    return fetch_period_data(brand, 6, 4, '3days')
 
 
 def fetch_previous_weekly_data(brand: str) -> dict:
     """前週のデータを取得（8日前〜14日前）"""
-    end_date = (datetime.now() - timedelta(days=8)).strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=14)).strftime('%Y-%m-%d')
-    df = fetch_ecommerce_data(brand, start_date, end_date)
-    
-    if df is not None:
-        return {
-            'data': df,
-            'period': {
-                'start_date': datetime.strptime(start_date, '%Y-%m-%d'),
-                'end_date': datetime.strptime(end_date, '%Y-%m-%d'),
-                'days': 7,
-                'period_type': 'weekly'
-            }
-        }
-    return None
+    return fetch_period_data(brand, 14, 8, 'weekly')
 
 
 def fetch_weekly_data(brand: str) -> dict:
     """過去7日間のデータを取得"""
-    end_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    df = fetch_ecommerce_data(brand, start_date, end_date)
-    
-    if df is not None:
-        return {
-            'data': df,
-            'period': {
-                'start_date': datetime.strptime(start_date, '%Y-%m-%d'),
-                'end_date': datetime.strptime(end_date, '%Y-%m-%d'),
-                'days': 7,
-                'period_type': 'weekly'
-            }
-        }
-    return None
+    return fetch_period_data(brand, 7, 1, 'weekly')
 
 
 def fetch_custom_data(brand: str, start_date: str, end_date: str) -> dict:
@@ -280,6 +345,22 @@ def fetch_custom_data(brand: str, start_date: str, end_date: str) -> dict:
     return None
 
 
+# 期間タイプごとの取得関数（未知の期間タイプは週次）
+PERIOD_FETCHERS = {
+    'yesterday': fetch_yesterday_data,
+    '3days': fetch_3days_data,
+    'weekly': fetch_weekly_data,
+}
+
+
+# 期間タイプごとの前期間（比較用）の取得関数
+PREVIOUS_PERIOD_FETCHERS = {
+    'yesterday': fetch_day_before_yesterday_data,
+    '3days': fetch_previous_3days_data,
+    'weekly': fetch_previous_weekly_data,
+}
+
+
 def fetch_all_brands_data(period_type: str = 'weekly') -> dict:
     """
     全ブランドのデータを取得
@@ -291,73 +372,83 @@ def fetch_all_brands_data(period_type: str = 'weekly') -> dict:
         dict: {brand: {'data': df, 'period': {...}}, ...}
     """
     config = get_ga4_config()
-    results = {}
+    fetcher = PERIOD_FETCHERS.get(period_type, fetch_weekly_data)
     
+    calls = {}
     for brand, prop_id in config['properties'].items():
         if not prop_id:
             print(f"[WARN] Skipping {brand} - no property ID configured")
             continue
-        
-        if period_type == 'yesterday':
-            result = fetch_yesterday_data(brand)
-        elif period_type == '3days':
-            result = fetch_3days_data(brand)
-        else:  # weekly
-            result = fetch_weekly_data(brand)
-        
-        if result is not None:
-            results[brand] = result
-    
-    return results
+        calls[brand] = (fetcher, brand)
+    
+    # ブランドごとのRPCは独立しているので並列に投げる
+    fetched = fetch_parallel(calls)
+    return {brand: result for brand, result in fetched.items() if result is not None}
+
+
+def run_channel_report(client, property_id: str, date_ranges: list) -> dict:
+    """チャネル×ソースのレポートを実行して {期間名: DataFrame} を返す"""
+    from google.analytics.data_v1beta.types import RunReportRequest, Dimension, Metric
+    
+    # チャネルグループ + 詳細ソースを取得
+    request = RunReportRequest(
+        property=f"properties/{property_id}",
+        dimensions=[
+            Dimension(name="sessionDefaultChannelGroup"),
+            Dimension(name="sessionSource"),
+        ],
+        metrics=[
+            Metric(name="sessions"),
+            Metric(name="activeUsers"),
+            Metric(name="ecommercePurchases"),
+            Metric(name="purchaseRevenue"),
+        ],
+        date_ranges=date_ranges,
+    )
+    
+    response = run_report_all_rows(client, request)
+    
+    # 期間が複数あるときはGA4が末尾にdateRangeディメンション（期間名）を付けて返す
+    if len(date_ranges) == 1:
+        return {date_ranges[0].name: report_to_frame(response, CHANNEL_REPORT_COLUMNS)}
+    
+    dimension_cols, metric_cols = CHANNEL_REPORT_COLUMNS
+    df = report_to_frame(response, (dimension_cols + ['date_range'], metric_cols))
+    return {
+        date_range.name: df[df['date_range'] == date_range.name].drop(columns='date_range').reset_index(drop=True)
+        for date_range in date_ranges
+    }
 
 
 def fetch_channel_data(brand: str, start_date: str, end_date: str) -> pd.DataFrame:
     """
     チャネル別のトラフィック・売上データを取得（詳細ソース含む）
     """
-    client = get_ga4_client()
+    config = get_ga4_config()
+    client = get_ga4_client(config)
     if client is None:
         return None
     
-    config = get_ga4_config()
     property_id = config['properties'].get(brand, '')
     
     if not property_id:
         print(f"[ERROR] GA4 property ID not set for brand: {brand}")
         return None
     
+    cache_key = ('channel', property_id, start_date, end_date)
+    cached = get_cached_report(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        # チャネルグループ + 詳細ソースを取得
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            dimensions=[
-                Dimension(name="sessionDefaultChannelGroup"),
-                Dimension(name="sessionSource"),
-            ],
-            metrics=[
-                Metric(name="sessions"),
-                Metric(name="activeUsers"),
-                Metric(name="ecommercePurchases"),
-                Metric(name="purchaseRevenue"),
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        )
+        from google.analytics.data_v1beta.types import DateRange
         
-        response = client.run_report(request)
-        
-        rows = []
-        for row in response.rows:
-            rows.append({
-                'channel': row.dimension_values[0].value,
-                'source': row.dimension_values[1].value,
-                'sessions': int(row.metric_values[0].value),
-                'users': int(row.metric_values[1].value),
-                'purchases': int(row.metric_values[2].value),
-                'revenue': float(row.metric_values[3].value),
-            })
-        
-        df = pd.DataFrame(rows)
+        frames = run_channel_report(client, property_id, [
+            DateRange(start_date=start_date, end_date=end_date, name='current'),
+        ])
+        df = frames['current']
         print(f"[OK] Fetched channel data for {brand}: {len(df)} sources")
+        save_cached_report(cache_key, df)
         return df
     
     except Exception as e:
@@ -365,6 +456,44 @@ def fetch_channel_data(brand: str, start_date: str, end_date: str) -> pd.DataFra
         return None
 
 
+def fetch_channel_data_with_previous(brand: str, start_date: str, end_date: str,
+                                     prev_start: str, prev_end: str) -> tuple:
+    """当期と前期のチャネルデータを1回のリクエストでまとめて取得（取得失敗時は(None, None)）"""
+    config = get_ga4_config()
+    client = get_ga4_client(config)
+    if client is None:
+        return None, None
+    
+    property_id = config['properties'].get(brand, '')
+    
+    if not property_id:
+        print(f"[ERROR] GA4 property ID not set for brand: {brand}")
+        return None, None
+    
+    # 前期がキャッシュ済みなら当期だけ取れば足りる
+    prev_key = ('channel', property_id, prev_start, prev_end)
+    prev_df = get_cached_report(prev_key)
+    if prev_df is not None:
+        return fetch_channel_data(brand, start_date, end_date), prev_df
+    
+    try:
+        from google.analytics.data_v1beta.types import DateRange
+        
+        frames = run_channel_report(client, property_id, [
+            DateRange(start_date=start_date, end_date=end_date, name='current'),
+            DateRange(start_date=prev_start, end_date=prev_end, name='previous'),
+        ])
+        df, prev_df = frames['current'], frames['previous']
+        print(f"[OK] Fetched channel data for {brand}: {len(df)} sources (previous: {len(prev_df)})")
+        save_cached_report(('channel', property_id, start_date, end_date), df)
+        save_cached_report(prev_key, prev_df)
+        return df, prev_df
+    
+    except Exception as e:
+        print(f"[ERROR] Error fetching channel data for {brand}: {e}")
+        return None, None
+
+
 # チャネル名の日本語マッピング
 CHANNEL_NAME_MAP = {
     'Organic Search': '🔍 自然検索（Google等）',
@@ -411,17 +540,24 @@ def fetch_campaign_data(brand: str, start_date: str, end_date: str) -> pd.DataFr
     """
     キャンペーン別のトラフィック・売上データを取得
     """
-    client = get_ga4_client()
+    config = get_ga4_config()
+    client = get_ga4_client(config)
     if client is None:
         return None
     
-    config = get_ga4_config()
     property_id = config['properties'].get(brand, '')
     
     if not property_id:
         return None
     
+    cache_key = ('campaign', property_id, start_date, end_date)
+    cached = get_cached_report(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
+        from google.analytics.data_v1beta.types import RunReportRequest, Dimension, Metric, DateRange
+        
         request = RunReportRequest(
             property=f"properties/{property_id}",
             dimensions=[
@@ -438,22 +574,11 @@ def fetch_campaign_data(brand: str, start_date: str, end_date: str) -> pd.DataFr
             date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
         )
         
-        response = client.run_report(request)
+        response = run_report_all_rows(client, request)
         
-        rows = []
-        for row in response.rows:
-            rows.append({
-                'campaign': row.dimension_values[0].value,
-                'source': row.dimension_values[1].value,
-                'medium': row.dimension_values[2].value,
-                'sessions': int(row.metric_values[0].value),
-                'users': int(row.metric_values[1].value),
-                'purchases': int(row.metric_values[2].value),
-                'revenue': float(row.metric_values[3].value),
-            })
-        
-        df = pd.DataFrame(rows)
+        df = report_to_frame(response, CAMPAIGN_REPORT_COLUMNS)
         print(f"[OK] Fetched campaign data for {brand}: {len(df)} campaigns")
+        save_cached_report(cache_key, df)
         return df
     
     except Exception as e:
@@ -540,40 +665,43 @@ def classify_ad_type(campaign: str, source: str, medium: str) -> str:
     return None  # 広告ではない
 
 
+# 期間タイプごとの (当期, 前期) の (N日前, M日前)
+COMPARISON_DAYS_AGO = {
+    'yesterday': ((1, 1), (2, 2)),
+    '3days': ((3, 1), (6, 4)),
+    'weekly': ((7, 1), (14, 8)),
+}
+
+
+def get_comparison_dates(period_type: str) -> tuple:
+    """当期と前期の日付文字列 (開始, 終了, 前期開始, 前期終了) を返す"""
+    current, previous = COMPARISON_DAYS_AGO.get(period_type, COMPARISON_DAYS_AGO['weekly'])
+    today = datetime.now()
+    dates = get_date_range(*current, today=today) + get_date_range(*previous, today=today)
+    return tuple(dt.strftime('%Y-%m-%d') for dt in dates)
+
+
 def fetch_all_brands_campaign_data(period_type: str = 'weekly') -> dict:
     """全ブランドのキャンペーンデータを取得"""
     config = get_ga4_config()
     results = {}
     
-    # 期間計算
-    if period_type == 'yesterday':
-        start_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        end_date = start_date
-        prev_start = (datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d')
-        prev_end = prev_start
-    elif period_type == '3days':
-        end_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        start_date = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d')
-        prev_end = (datetime.now() - timedelta(days=4)).strftime('%Y-%m-%d')
-        prev_start = (datetime.now() - timedelta(days=6)).strftime('%Y-%m-%d')
-    else:  # weekly
-        end_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        prev_end = (datetime.now() - timedelta(days=8)).strftime('%Y-%m-%d')
-        prev_start = (datetime.now() - timedelta(days=14)).strftime('%Y-%m-%d')
+    start_date, end_date, prev_start, prev_end = get_comparison_dates(period_type)
     
+    calls = {}
     for brand in config['properties'].keys():
-        try:
-            df = fetch_campaign_data(brand, start_date, end_date)
-            prev_df = fetch_campaign_data(brand, prev_start, prev_end)
-            
-            if df is not None:
-                results[brand] = {
-                    'current': df,
-                    'previous': prev_df
-                }
-        except Exception as e:
-            print(f"[ERROR] Campaign data for {brand}: {e}")
+        calls[(brand, 'current')] = (fetch_campaign_data, brand, start_date, end_date)
+        calls[(brand, 'previous')] = (fetch_campaign_data, brand, prev_start, prev_end)
+    
+    # 当期・前期ともブランド横断で並列に取得
+    fetched = fetch_parallel(calls)
+    for brand in config['properties'].keys():
+        df = fetched[(brand, 'current')]
+        if df is not None:
+            results[brand] = {
+                'current': df,
+                'previous': fetched[(brand, 'previous')]
+            }
     
     return results
 
@@ -592,32 +720,16 @@ def fetch_all_brands_channel_data(period_type: str = 'weekly') -> dict:
     config = get_ga4_config()
     results = {}
     
-    # 期間計算
-    if period_type == 'yesterday':
-        start_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        end_date = start_date
-        prev_start = (datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d')
-        prev_end = prev_start
-    elif period_type == '3days':
-        start_date = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d')
-        end_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        prev_start = (datetime.now() - timedelta(days=6)).strftime('%Y-%m-%d')
-        prev_end = (datetime.now() - timedelta(days=4)).strftime('%Y-%m-%d')
-    else:  # weekly
-        start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        end_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        prev_start = (datetime.now() - timedelta(days=14)).strftime('%Y-%m-%d')
-        prev_end = (datetime.now() - timedelta(days=8)).strftime('%Y-%m-%d')
+    start_date, end_date, prev_start, prev_end = get_comparison_dates(period_type)
     
-    for brand, prop_id in config['properties'].items():
-        if not prop_id:
-            continue
-        
-        # 現在期間
-        df = fetch_channel_data(brand, start_date, end_date)
-        # 前期間
-        prev_df = fetch_channel_data(brand, prev_start, prev_end)
-        
+    brands = [brand for brand, prop_id in config['properties'].items() if prop_id]
+    # 現在期間と前期間は1リクエストにまとめ、ブランド間は並列に取得
+    fetched = fetch_parallel({
+        brand: (fetch_channel_data_with_previous, brand, start_date, end_date, prev_start, prev_end)
+        for brand in brands
+    })
+    for brand in brands:
+        df, prev_df = fetched[brand] or (None, None)
         if df is not None:
             results[brand] = {
                 'current': df,
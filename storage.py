@@ -4,11 +4,13 @@ Cloudflare R2 ストレージ連携
 - S3互換APIを使用
 """
 
+import codecs
 import os
-import boto3
-from botocore.config import Config
+import threading
+import time
+import numpy as np
 import pandas as pd
-from io import StringIO, BytesIO
+from io import BytesIO
 
 
 def get_r2_config():
@@ -22,6 +24,39 @@ def get_r2_config():
     }
 
 
+# 商品マスタ探索の対象外にするフォルダ（GA4データ・期間データ・チャネル/キャンペーンデータ・設定）
+PRODUCT_MASTER_EXCLUDED_PREFIXES = ('ga4_data/', 'periods/', 'channels/', 'campaigns/', 'config/')
+
+# 最新の商品マスタCSV（LIST結果）を使い回す秒数
+LATEST_CSV_CACHE_TTL = 60
+latest_csv_cache = {'bucket': None, 'latest': None, 'expires': 0.0}
+latest_csv_lock = threading.Lock()
+
+# GAデータCSVの読み込み型（sku_idは数値として読むと先頭の0が落ちて商品マスタと突き合わなくなる）
+GA_DATA_CSV_DTYPES = {'sku_id': str}
+
+# GAデータCSVの件数カラム（空欄や"12.0"のような表記でも読めるよう、読み込み後にint32へ変換）
+GA_DATA_COUNT_COLS = ['views', 'add_to_cart', 'purchases']
+
+# 期間データとして読み込むのに必要なカラム
+GA_DATA_REQUIRED_COLS = frozenset(['sku_id', 'views', 'add_to_cart', 'purchases', 'revenue'])
+
+# 文字コード判定に使う先頭バイト数
+ENCODING_SNIFF_BYTES = 4096
+
+# 商品マスタのアップロードはこのサイズごとに分割して並列に送る
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_CONCURRENCY = 4
+
+# R2クライアントのコネクションプール上限（boto3の既定は10）
+R2_MAX_POOL_CONNECTIONS = 32
+
+
+# R2クライアントのキャッシュ（作成は重いので設定が変わるまで使い回す、作成済みのクライアントはスレッド間で共有できる）
+r2_client_cache = {'key': None, 'client': None}
+r2_client_lock = threading.Lock()
+
+
 def get_r2_client():
     """R2クライアントを取得"""
     config = get_r2_config()
@@ -30,14 +65,29 @@ def get_r2_client():
         print(f"R2 config missing: ENDPOINT={bool(config['endpoint_url'])}, KEY={bool(config['access_key_id'])}, SECRET={bool(config['secret_access_key'])}")
         return None
     
-    return boto3.client(
-        's3',
-        endpoint_url=config['endpoint_url'],
-        aws_access_key_id=config['access_key_id'],
-        aws_secret_access_key=config['secret_access_key'],
-        config=Config(signature_version='s3v4'),
-        region_name='auto'
-    )
+    key = (config['endpoint_url'], config['access_key_id'], config['secret_access_key'])
+    # boto3のクライアント作成はスレッドセーフではないのでロックの中で行う
+    with r2_client_lock:
+        if r2_client_cache['key'] != key:
+            # boto3はR2が設定されているときだけ読み込む（未設定環境の起動を軽くする）
+            import boto3
+            from botocore.config import Config
+            
+            r2_client_cache['client'] = boto3.client(
+                's3',
+                endpoint_url=config['endpoint_url'],
+                aws_access_key_id=config['access_key_id'],
+                aws_secret_access_key=config['secret_access_key'],
+                # 並列の読み込み・保存がコネクション待ちにならないようプールを広げ、アイドル接続はkeepaliveで保つ
+                config=Config(
+                    signature_version='s3v4',
+                    max_pool_connections=R2_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True
+                ),
+                region_name='auto'
+            )
+            r2_client_cache['key'] = key
+        return r2_client_cache['client']
 
 
 def is_r2_enabled():
@@ -46,7 +96,42 @@ def is_r2_enabled():
     return all([config['endpoint_url'], config['access_key_id'], config['secret_access_key']])
 
 
+def find_latest_object(client, bucket, prefix='', accept=None):
+    """prefix配下で最も新しいオブジェクトを返す（acceptで対象キーを絞る、なければNone）"""
+    # 1回のLISTは1000件までなので全ページを見る（一覧は作らず最新だけを持ち回る）
+    latest = None
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if accept is not None and not accept(obj['Key']):
+                continue
+            if latest is None or obj['LastModified'] > latest['LastModified']:
+                latest = obj
+    return latest
+
+
 def find_latest_csv():
+    """R2バケット内の最新の商品マスタCSVファイルを見つける（直近のLIST結果があればそれを使う）"""
+    config = get_r2_config()
+    # 情報取得とダウンロードで同じLISTを何度も投げないよう、短時間だけ結果を使い回す
+    with latest_csv_lock:
+        if latest_csv_cache['bucket'] == config['bucket_name'] and time.monotonic() < latest_csv_cache['expires']:
+            return latest_csv_cache['latest']
+        
+        latest = list_latest_csv()
+        if latest is not None:
+            latest_csv_cache.update(bucket=config['bucket_name'], latest=latest,
+                                    expires=time.monotonic() + LATEST_CSV_CACHE_TTL)
+        return latest
+
+
+def invalidate_latest_csv():
+    """最新CSVのキャッシュを捨てる（アップロード後に呼ぶ）"""
+    with latest_csv_lock:
+        latest_csv_cache['expires'] = 0.0
+
+
+def list_latest_csv():
     """R2バケット内の最新の商品マスタCSVファイルを見つける（ga4_data/は除外）"""
     client = get_r2_client()
     if client is None:
@@ -55,24 +140,20 @@ def find_latest_csv():
     config = get_r2_config()
     
     try:
-        response = client.list_objects_v2(Bucket=config['bucket_name'])
-        csv_files = []
-        for obj in response.get('Contents', []):
-            key = obj['Key']
-            # ga4_data/ と periods/ フォルダは除外（商品マスタのみ対象）
-            if key.endswith('.csv') and not key.startswith('ga4_data/') and not key.startswith('periods/') and not key.startswith('config/'):
-                csv_files.append({
-                    'key': key,
-                    'last_modified': obj['LastModified'],
-                    'size': obj['Size']
-                })
-        
-        if not csv_files:
+        # アプリが保存するデータのフォルダは除外（商品マスタのみ対象）
+        obj = find_latest_object(
+            client, config['bucket_name'],
+            accept=lambda key: key.endswith('.csv') and not key.startswith(PRODUCT_MASTER_EXCLUDED_PREFIXES)
+        )
+        if obj is None:
             print("[ERROR] No product master CSV files found in R2")
             return None
         
-        # 最新のファイルを取得
-        latest = max(csv_files, key=lambda x: x['last_modified'])
+        latest = {
+            'key': obj['Key'],
+            'last_modified': obj['LastModified'],
+            'size': obj['Size']
+        }
         print(f"[OK] Found product master CSV: {latest['key']}")
         return latest
     except Exception as e:
@@ -80,6 +161,35 @@ def find_latest_csv():
         return None
 
 
+def read_ga_data_csv(body):
+    """R2に保存したGAデータCSVを読み込み、件数カラムをint32に揃える"""
+    df = pd.read_csv(body, encoding='utf-8', dtype=GA_DATA_CSV_DTYPES)
+    for col in GA_DATA_COUNT_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('int32')
+    return df
+
+
+def none_to_nan(df):
+    """文字列カラムの欠損をNaNに揃える（PyArrow経由で読むとNoneになり、Cエンジンで読んだCSVと食い違う）"""
+    obj_cols = df.columns[df.dtypes == object]
+    df[obj_cols] = df[obj_cols].where(df[obj_cols].notna(), np.nan)
+    return df
+
+
+def detect_content_encoding(content):
+    """CSVの先頭バイトから文字コードを判定（BOM→utf-8-sig、UTF-8として読めればutf-8、それ以外はcp932）"""
+    head = content[:ENCODING_SNIFF_BYTES]
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # 末尾で途切れたマルチバイト文字はエラーにしない
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp932'
+
+
 def download_product_master():
     """R2から商品マスタCSVをダウンロード（最新のCSVを自動検出）"""
     client = get_r2_client()
@@ -98,11 +208,11 @@ def download_product_master():
         response = client.get_object(Bucket=config['bucket_name'], Key=file_key)
         content = response['Body'].read()
         
-        # エンコーディング検出して読み込み
-        for enc in ['utf-8', 'utf-8-sig', 'cp932']:
+        # 先頭だけで文字コードを判定して1回で読む（外れたときだけ残りを試す）
+        detected = detect_content_encoding(content)
+        for enc in [detected] + [enc for enc in ['utf-8', 'utf-8-sig', 'cp932'] if enc != detected]:
             try:
-                csv_str = content.decode(enc)
-                df = pd.read_csv(StringIO(csv_str))
+                df = pd.read_csv(BytesIO(content), encoding=enc, low_memory=False)
                 print(f"[OK] Downloaded product master from R2: {len(df)} rows")
                 return df
             except Exception as e:
@@ -126,13 +236,21 @@ def upload_product_master(filepath):
     config = get_r2_config()
     
     try:
-        with open(filepath, 'rb') as f:
-            client.put_object(
-                Bucket=config['bucket_name'],
-                Key=config['product_master_key'],
-                Body=f,
-                ContentType='text/csv'
+        from boto3.s3.transfer import TransferConfig
+        
+        # put_objectは署名のためにファイル全体をメモリに載せるので、分割アップロードでストリーミングする
+        client.upload_file(
+            filepath,
+            config['bucket_name'],
+            config['product_master_key'],
+            ExtraArgs={'ContentType': 'text/csv'},
+            Config=TransferConfig(
+                multipart_threshold=UPLOAD_PART_SIZE,
+                multipart_chunksize=UPLOAD_PART_SIZE,
+                max_concurrency=UPLOAD_MAX_CONCURRENCY
             )
+        )
+        invalidate_latest_csv()
         print(f"[OK] Uploaded product master to R2: {config['product_master_key']}")
         return True
     except Exception as e:
@@ -140,24 +258,28 @@ def upload_product_master(filepath):
         return False
 
 
-def list_r2_files():
-    """R2バケット内のファイル一覧を取得"""
+def iter_r2_files(prefix=''):
+    """R2バケット内のファイルを1件ずつ返す（一覧を作らずに途中で絞り込み・打ち切りできる）"""
     client = get_r2_client()
     if client is None:
-        return []
+        return
     
     config = get_r2_config()
     
-    try:
-        response = client.list_objects_v2(Bucket=config['bucket_name'])
-        files = []
-        for obj in response.get('Contents', []):
-            files.append({
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=config['bucket_name'], Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield {
                 'key': obj['Key'],
                 'size': obj['Size'],
                 'last_modified': obj['LastModified']
-            })
-        return files
+            }
+
+
+def list_r2_files():
+    """R2バケット内のファイル一覧を取得"""
+    try:
+        return list(iter_r2_files())
     except Exception as e:
         print(f"Error listing R2 files: {e}")
         return []
@@ -176,14 +298,14 @@ def save_ga4_data(brand, df, start_date, end_date):
         # ファイル名: ga4_data/brand_YYYYMMDD_YYYYMMDD.csv
         filename = f"ga4_data/{brand}_{start_date}_{end_date}.csv"
         
-        # DataFrameをCSVに変換
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False)
+        # DataFrameをCSVに変換（文字列を経由せずバイト列に直接書き出す）
+        csv_buffer = BytesIO()
+        df.to_csv(csv_buffer, index=False, encoding='utf-8')
         
         client.put_object(
             Bucket=config['bucket_name'],
             Key=filename,
-            Body=csv_buffer.getvalue().encode('utf-8'),
+            Body=csv_buffer.getvalue(),
             ContentType='text/csv'
         )
         print(f"[OK] Saved GA4 data to R2: {filename} ({len(df)} rows)")
@@ -202,12 +324,14 @@ def save_period_data(period_type, brand, df, start_date, end_date, is_previous=F
     config = get_r2_config()
     
     try:
-        # ファイル名: periods/period_type/brand.csv または periods/period_type/brand_prev.csv
+        # ファイル名: periods/period_type/brand.parquet または periods/period_type/brand_prev.parquet
+        # （以前はCSVで保存していたので、読み込み時はCSVにもフォールバックする）
         suffix = "_prev" if is_previous else ""
-        filename = f"periods/{period_type}/{brand}{suffix}.csv"
+        filename = f"periods/{period_type}/{brand}{suffix}.parquet"
         
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False)
+        # Parquetなら型がそのまま残り、CSVより小さく速く読める
+        buffer = BytesIO()
+        df.to_parquet(buffer, index=False, compression='zstd')
         
         # メタデータとして日付を保存
         metadata = {
@@ -218,8 +342,8 @@ def save_period_data(period_type, brand, df, start_date, end_date, is_previous=F
         client.put_object(
             Bucket=config['bucket_name'],
             Key=filename,
-            Body=csv_buffer.getvalue().encode('utf-8'),
-            ContentType='text/csv',
+            Body=buffer.getvalue(),
+            ContentType='application/vnd.apache.parquet',
             Metadata=metadata
         )
         print(f"[OK] Saved period data: {filename}")
@@ -239,17 +363,21 @@ def load_period_data(period_type, brand, is_previous=False):
     
     try:
         suffix = "_prev" if is_previous else ""
-        filename = f"periods/{period_type}/{brand}{suffix}.csv"
+        filename = f"periods/{period_type}/{brand}{suffix}"
         
-        response = client.get_object(Bucket=config['bucket_name'], Key=filename)
-        content = response['Body'].read().decode('utf-8')
-        df = pd.read_csv(StringIO(content))
+        try:
+            response = client.get_object(Bucket=config['bucket_name'], Key=f"{filename}.parquet")
+            df = none_to_nan(pd.read_parquet(BytesIO(response['Body'].read())))
+        except client.exceptions.NoSuchKey:
+            # Parquet化する前に保存されたCSV
+            response = client.get_object(Bucket=config['bucket_name'], Key=f"{filename}.csv")
+            # 本文を文字列にしてから読まず、レスポンスのストリームから直接パースする
+            df = read_ga_data_csv(response['Body'])
         
         # 必須カラムの検証
-        required_cols = ['sku_id', 'views', 'add_to_cart', 'purchases', 'revenue']
-        missing_cols = [col for col in required_cols if col not in df.columns]
+        missing_cols = GA_DATA_REQUIRED_COLS.difference(df.columns)
         if missing_cols:
-            print(f"[WARN] Period data {period_type}/{brand} missing columns: {missing_cols}, skipping")
+            print(f"[WARN] Period data {period_type}/{brand} missing columns: {sorted(missing_cols)}, skipping")
             return None
         
         # メタデータから日付を取得
@@ -308,8 +436,8 @@ def save_channel_data(period_type, brand, channel_df, start_date, end_date, is_p
         suffix = "_prev" if is_previous else ""
         filename = f"channels/{period_type}/{brand}{suffix}.csv"
         
-        csv_buffer = StringIO()
-        channel_df.to_csv(csv_buffer, index=False)
+        csv_buffer = BytesIO()
+        channel_df.to_csv(csv_buffer, index=False, encoding='utf-8')
         
         metadata = {
             'start_date': start_date,
@@ -319,7 +447,7 @@ def save_channel_data(period_type, brand, channel_df, start_date, end_date, is_p
         client.put_object(
             Bucket=config['bucket_name'],
             Key=filename,
-            Body=csv_buffer.getvalue().encode('utf-8'),
+            Body=csv_buffer.getvalue(),
             ContentType='text/csv',
             Metadata=metadata
         )
@@ -343,8 +471,7 @@ def load_channel_data(period_type, brand, is_previous=False):
         filename = f"channels/{period_type}/{brand}{suffix}.csv"
         
         response = client.get_object(Bucket=config['bucket_name'], Key=filename)
-        content = response['Body'].read().decode('utf-8')
-        df = pd.read_csv(StringIO(content))
+        df = pd.read_csv(response['Body'], encoding='utf-8')
         
         metadata = response.get('Metadata', {})
         
@@ -373,8 +500,8 @@ def save_campaign_data(period_type, brand, campaign_df, start_date, end_date, is
         suffix = "_prev" if is_previous else ""
         filename = f"campaigns/{period_type}/{brand}{suffix}.csv"
         
-        csv_buffer = StringIO()
-        campaign_df.to_csv(csv_buffer, index=False)
+        csv_buffer = BytesIO()
+        campaign_df.to_csv(csv_buffer, index=False, encoding='utf-8')
         
         metadata = {
             'start_date': start_date,
@@ -384,7 +511,7 @@ def save_campaign_data(period_type, brand, campaign_df, start_date, end_date, is
         client.put_object(
             Bucket=config['bucket_name'],
             Key=filename,
-            Body=csv_buffer.getvalue().encode('utf-8'),
+            Body=csv_buffer.getvalue(),
             ContentType='text/csv',
             Metadata=metadata
         )
@@ -408,8 +535,7 @@ def load_campaign_data(period_type, brand, is_previous=False):
         filename = f"campaigns/{period_type}/{brand}{suffix}.csv"
         
         response = client.get_object(Bucket=config['bucket_name'], Key=filename)
-        content = response['Body'].read().decode('utf-8')
-        df = pd.read_csv(StringIO(content))
+        df = pd.read_csv(response['Body'], encoding='utf-8')
         
         metadata = response.get('Metadata', {})
         
@@ -436,27 +562,18 @@ def get_latest_ga4_data(brand):
     
     try:
         # ga4_data/ フォルダ内のファイルを検索
-        response = client.list_objects_v2(
-            Bucket=config['bucket_name'],
-            Prefix=f"ga4_data/{brand}_"
-        )
-        
-        files = []
-        for obj in response.get('Contents', []):
-            files.append({
-                'key': obj['Key'],
-                'last_modified': obj['LastModified']
-            })
-        
-        if not files:
+        obj = find_latest_object(client, config['bucket_name'], prefix=f"ga4_data/{brand}_")
+        if obj is None:
             return None
         
         # 最新のファイルを取得
-        latest = max(files, key=lambda x: x['last_modified'])
+        latest = {
+            'key': obj['Key'],
+            'last_modified': obj['LastModified']
+        }
         
         response = client.get_object(Bucket=config['bucket_name'], Key=latest['key'])
-        content = response['Body'].read().decode('utf-8')
-        df = pd.read_csv(StringIO(content))
+        df = read_ga_data_csv(response['Body'])
         
         # ファイル名から日付を抽出
         filename = latest['key'].split('/')[-1]  # brand_YYYYMMDD_YYYYMMDD.csv